@@ -0,0 +1,308 @@
+"""Local stand-in for the Spotify Web API used by the benchmarks.
+
+It serves a generated library (top tracks, artists with genres and the
+user's playlists) over HTTP on localhost, implements the endpoints the
+project uses, and can add latency and inject 429 responses.
+"""
+import json
+import random
+import re
+import threading
+import time
+import hashlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+USER_ID = 'bench_user'
+
+GENRES = [
+    'pop', 'dance pop', 'electropop', 'k-pop', 'j-pop', 'rock', 'modern rock',
+    'indie rock', 'alternative rock', 'pop rock', 'album rock', 'rap', 'melodic rap',
+    'hip hop', 'trap', 'drill', 'edm', 'electro', 'house', 'jazz', 'soul', 'r&b',
+    'country', 'folk', 'metal', 'punk', 'classical', 'latin', 'reggaeton', 'afrobeats'
+]
+
+TIME_RANGES = ('short_term', 'medium_term', 'long_term')
+
+class FakeLibrary:
+    """Generated Spotify library: artists, top tracks per time range and playlists."""
+
+    def __init__(self, num_playlists=50, num_artists=1000, num_top_tracks=500, num_plays=200, seed=0):
+        rng = random.Random(seed)
+        self.artists = {}
+        for i in range(num_artists):
+            artist_id = f'artist{i:05d}'
+            self.artists[artist_id] = {
+                'id': artist_id,
+                'name': f'Artist {i}',
+                'uri': f'spotify:artist:{artist_id}',
+                'genres': rng.sample(GENRES, rng.randint(0, 4)),
+                'popularity': rng.randint(0, 100),
+                'followers': {'href': None, 'total': rng.randint(0, 10 ** 6)},
+                'images': [{'url': f'https://i.scdn.co/image/{artist_id}{s}', 'height': s, 'width': s}
+                           for s in (640, 320, 160)],
+                'external_urls': {'spotify': f'https://open.spotify.com/artist/{artist_id}'},
+                'href': f'https://api.spotify.com/v1/artists/{artist_id}',
+                'type': 'artist'
+            }
+        artist_ids = list(self.artists)
+
+        self.top_tracks = {}
+        for time_range in TIME_RANGES:
+            tracks = []
+            for i in range(num_top_tracks):
+                track_id = f'{time_range[0]}track{rng.randint(0, num_top_tracks * 3):06d}'
+                artists = [self.artists[a] for a in rng.sample(artist_ids, rng.randint(1, 2))]
+                tracks.append(self._track(track_id, artists, rng))
+            self.top_tracks[time_range] = tracks
+
+        # Recent plays, oldest first, one every few minutes up to now
+        catalog = [track for tracks in self.top_tracks.values() for track in tracks]
+        now_ms = int(time.time() * 1000)
+        self.plays = [(now_ms - (num_plays - i) * 180000, rng.choice(catalog)) for i in range(num_plays)]
+
+        self.playlists = []
+        for i in range(num_playlists):
+            owner = USER_ID if rng.random() < 0.8 else f'friend{i % 7}'
+            self.playlists.append(self._playlist(f'playlist{i:06d}', f'Playlist {i}', owner))
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _track(track_id, artists, rng):
+        return {
+            'id': track_id,
+            'uri': f'spotify:track:{track_id}',
+            'name': f'Track {track_id}',
+            'artists': [{key: a[key] for key in ('id', 'name', 'uri', 'href', 'type', 'external_urls')}
+                        for a in artists],
+            'album': {
+                'id': f'album{track_id}',
+                'name': f'Album {track_id}',
+                'images': [{'url': f'https://i.scdn.co/image/album{track_id}{s}', 'height': s, 'width': s}
+                           for s in (640, 300, 64)],
+                'available_markets': ['US', 'GB', 'DE', 'FR', 'SE', 'JP', 'BR', 'CA', 'AU', 'MX'],
+                'release_date': '2024-01-01'
+            },
+            'available_markets': ['US', 'GB', 'DE', 'FR', 'SE', 'JP', 'BR', 'CA', 'AU', 'MX'],
+            'duration_ms': rng.randint(120000, 300000),
+            'popularity': rng.randint(0, 100),
+            'explicit': False,
+            'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id}'},
+            'href': f'https://api.spotify.com/v1/tracks/{track_id}',
+            'type': 'track'
+        }
+
+    @staticmethod
+    def _playlist(playlist_id, name, owner, description=''):
+        return {
+            'id': playlist_id,
+            'name': name,
+            'description': description,
+            'owner': {'id': owner, 'display_name': owner},
+            'collaborative': False,
+            'public': False,
+            'snapshot_id': f'{playlist_id}-0',
+            'uris': []
+        }
+
+    def find_playlist(self, playlist_id):
+        for playlist in self.playlists:
+            if playlist['id'] == playlist_id:
+                return playlist
+        return None
+
+def _public(playlist):
+    result = {key: value for key, value in playlist.items() if key != 'uris'}
+    result['tracks'] = {'total': len(playlist['uris'])}
+    return result
+
+def _bump(playlist):
+    base, version = playlist['snapshot_id'].rsplit('-', 1)
+    playlist['snapshot_id'] = f'{base}-{int(version) + 1}'
+    return {'snapshot_id': playlist['snapshot_id']}
+
+class FakeSpotifyServer:
+    """Threaded HTTP server serving a FakeLibrary.
+
+    latency is added to every response (seconds), and a fraction rate_limit_ratio
+    of requests is answered with 429 and a Retry-After of retry_after seconds.
+    """
+
+    def __init__(self, library, latency=0.0, rate_limit_ratio=0.0, retry_after=1, seed=0):
+        self.library = library
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.requests = []
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_port}/v1/'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_counts(self):
+        self.requests = []
+
+    def _should_throttle(self):
+        if not self.rate_limit_ratio:
+            return False
+        with self._rng_lock:
+            return self._rng.random() < self.rate_limit_ratio
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=None, headers=None):
+                data = json.dumps(body).encode() if body is not None else b''
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                data = self.rfile.read(length) if length else b''
+                return json.loads(data) if data else None
+
+            def _handle(self):
+                parsed = urlparse(self.path)
+                path = parsed.path.rstrip('/')
+                query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                body = self._body()
+                server.requests.append((self.command, path))
+
+                if server.latency:
+                    time.sleep(server.latency)
+                if server._should_throttle():
+                    return self._send(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                                      {'Retry-After': str(server.retry_after)})
+                with server.library.lock:
+                    return self._route(self.command, path, query, body)
+
+            def _route(self, method, path, query, body):
+                library = server.library
+                if path == '/v1/me':
+                    return self._send(200, {'id': USER_ID, 'display_name': 'Bench User'})
+
+                if path == '/v1/me/top/tracks':
+                    tracks = library.top_tracks[query.get('time_range', 'medium_term')]
+                    offset, limit = int(query.get('offset', 0)), int(query.get('limit', 20))
+                    page = {'items': tracks[offset:offset + limit], 'total': len(tracks),
+                            'limit': limit, 'offset': offset}
+                    etag = '"' + hashlib.md5(json.dumps(page).encode()).hexdigest() + '"'
+                    if self.headers.get('If-None-Match') == etag:
+                        return self._send(304, None, {'ETag': etag})
+                    return self._send(200, page, {'ETag': etag})
+
+                if path == '/v1/me/player/recently-played':
+                    limit = int(query.get('limit', 20))
+                    if 'after' in query:
+                        plays = [p for p in library.plays if p[0] > int(query['after'])][:limit]
+                    else:
+                        plays = [p for p in library.plays if p[0] < int(query.get('before', 2 ** 62))][-limit:]
+                    items = [{'played_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(ms / 1000))
+                                           + f'.{ms % 1000:03d}Z',
+                              'track': track} for ms, track in reversed(plays)]
+                    cursors = {'after': str(plays[-1][0]), 'before': str(plays[0][0])} if plays else None
+                    return self._send(200, {'items': items, 'cursors': cursors, 'limit': limit, 'next': None})
+
+                if path == '/v1/artists':
+                    ids = query.get('ids', '').split(',')
+                    return self._send(200, {'artists': [library.artists.get(a) for a in ids]})
+
+                match = re.fullmatch(r'/v1/artists/([^/]+)', path)
+                if match:
+                    artist = library.artists.get(match.group(1))
+                    return self._send(200 if artist else 404, artist or {'error': {'message': 'not found'}})
+
+                if path == '/v1/me/playlists':
+                    offset, limit = int(query.get('offset', 0)), int(query.get('limit', 50))
+                    items = [_public(p) for p in library.playlists[offset:offset + limit]]
+                    return self._send(200, {'items': items, 'total': len(library.playlists),
+                                            'limit': limit, 'offset': offset})
+
+                match = re.fullmatch(r'/v1/users/([^/]+)/playlists', path)
+                if match and method == 'POST':
+                    playlist = library._playlist(f'playlist{len(library.playlists):06d}', body['name'],
+                                                 USER_ID, body.get('description') or '')
+                    library.playlists.insert(0, playlist)
+                    return self._send(201, _public(playlist))
+
+                match = re.fullmatch(r'/v1/playlists/([^/]+)(/tracks|/items)?', path)
+                if match:
+                    playlist = library.find_playlist(match.group(1))
+                    if playlist is None:
+                        return self._send(404, {'error': {'status': 404, 'message': 'Not found.'}})
+                    if match.group(2):
+                        return self._route_items(method, playlist, query, body)
+                    if method == 'GET':
+                        result = _public(playlist)
+                        result['tracks']['items'] = [{'track': {'uri': uri}} for uri in playlist['uris'][:100]]
+                        return self._send(200, result)
+                    if playlist['owner']['id'] != USER_ID:
+                        return self._send(403, {'error': {'status': 403, 'message': 'Forbidden'}})
+                    for key in ('name', 'description', 'public'):
+                        if key in body:
+                            playlist[key] = body[key]
+                    _bump(playlist)
+                    return self._send(200, None)
+
+                return self._send(404, {'error': {'status': 404, 'message': f'No route for {path}'}})
+
+            def _route_items(self, method, playlist, query, body):
+                uris = playlist['uris']
+                if method == 'GET':
+                    offset, limit = int(query.get('offset', 0)), int(query.get('limit', 100))
+                    items = [{'track': {'uri': uri}} for uri in uris[offset:offset + limit]]
+                    return self._send(200, {'items': items, 'total': len(uris)})
+                if playlist['owner']['id'] != USER_ID:
+                    return self._send(403, {'error': {'status': 403, 'message': 'Forbidden'}})
+                if method == 'POST':
+                    new = body if isinstance(body, list) else body['uris']
+                    position = query.get('position')
+                    position = len(uris) if position is None else int(position)
+                    uris[position:position] = new
+                    return self._send(201, _bump(playlist))
+                if method == 'PUT' and body and 'range_start' in body:
+                    start, length = body['range_start'], body.get('range_length', 1)
+                    insert_before = body['insert_before']
+                    block = uris[start:start + length]
+                    rest = uris[:start] + uris[start + length:]
+                    if insert_before > start:
+                        insert_before -= length
+                    playlist['uris'] = rest[:insert_before] + block + rest[insert_before:]
+                    return self._send(200, _bump(playlist))
+                if method == 'PUT':
+                    playlist['uris'] = list(body['uris'])
+                    return self._send(201, _bump(playlist))
+                if method == 'DELETE':
+                    removed = {item['uri'] for item in body.get('items', body.get('tracks', []))}
+                    playlist['uris'] = [uri for uri in uris if uri not in removed]
+                    return self._send(200, _bump(playlist))
+                return self._send(405, {'error': {'status': 405, 'message': 'Method not allowed'}})
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+        return Handler
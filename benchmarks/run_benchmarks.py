@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""Benchmark the entry points against a local fake Spotify API.
+
+For every library size this runs spotify_playlist_creator.main and one
+auto-update daemon cycle, each with an empty cache (cold) and again with
+the cache the cold run left behind (warm), and reports request counts,
+wall time, p50/p99 request latency and peak memory as JSON.
+
+Example:
+    python benchmarks/run_benchmarks.py --playlists 50 1000 10000 --latency 0.02 -o results.json
+"""
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+from collections import Counter
+from unittest import mock
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+import spotipy
+import spotify_utils
+import spotify_playlist_creator
+import auto_update_daemon
+from rate_limit import RequestScheduler, endpoint_key
+from spotify_io import build_session
+from fake_spotify import FakeLibrary, FakeSpotifyServer
+
+CREATOR_ARGS = ['20', '30', '--genre', 'rock', '--name', 'Bench Rock']
+
+DAEMON_SPECS = [
+    {'name': 'Bench Daemon Top', 'num_songs': 20, 'days': 30, 'genre': None},
+    {'name': 'Bench Daemon Rap', 'num_songs': 15, 'days': 30, 'genre': 'rap'},
+    {'name': 'Bench Daemon Pop', 'num_songs': 30, 'days': 180, 'genre': 'pop'},
+]
+
+def use_cache_dir(cache_dir):
+    """Point every cache file at cache_dir and drop the in-memory caches."""
+    for name, filename in [
+        ('PLAYLIST_CACHE_FILE', 'playlist_cache.json'),
+        ('PLAYLIST_STATE_FILE', 'playlist_state.json'),
+        ('PLAYLIST_INDEX_DIR', 'playlist_index'),
+        ('GENRE_CACHE_FILE', 'genre_cache.json'),
+        ('TOP_TRACKS_CACHE_DIR', 'top_tracks_cache'),
+        ('USER_PROFILE_FILE', 'user_profiles.json'),
+    ]:
+        setattr(spotify_utils, name, os.path.join(cache_dir, filename))
+    for name in ('_genre_cache', '_top_tracks_cache', '_playlist_index',
+                 '_playlist_store', '_playlist_state_store', '_user_profile_store'):
+        setattr(spotify_utils, name, None)
+    spotify_utils._genre_matchers.clear()
+    spotify_utils._user_ids.clear()
+
+class LatencyRecorder:
+    """Collects the latency of every HTTP response seen by a session."""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+
+    def hook(self, response, *args, **kwargs):
+        self.latencies.append(response.elapsed.total_seconds())
+        self.statuses[response.status_code] += 1
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        values = sorted(self.latencies)
+        index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+        return round(values[index] * 1000, 2)
+
+def create_client(server, recorder, requests_per_second):
+    """Spotify client talking to the fake server with a fixed token."""
+    scheduler = RequestScheduler(requests_per_second=requests_per_second, burst=int(requests_per_second),
+                                 base_delay=0.1)
+    session = build_session(scheduler=scheduler)
+    session.hooks['response'].append(recorder.hook)
+    sp = spotipy.Spotify(auth='benchmark-token', requests_session=session, retries=0)
+    sp.prefix = server.url
+    return sp
+
+def run_creator(sp):
+    with mock.patch.object(spotify_playlist_creator, 'create_spotify_client', return_value=sp), \
+            mock.patch.object(sys, 'argv', ['spotify_playlist_creator.py'] + CREATOR_ARGS):
+        try:
+            spotify_playlist_creator.main()
+        except SystemExit as e:
+            if e.code:
+                raise RuntimeError(f"spotify_playlist_creator exited with {e.code}")
+
+def run_daemon_cycle(sp):
+    if not auto_update_daemon.update_playlists_with_retry(DAEMON_SPECS, max_retries=1, sp=sp):
+        raise RuntimeError("daemon cycle failed")
+
+def measure(name, func, server, recorder, sp):
+    """Run func(sp) once and return its metrics."""
+    server.reset_counts()
+    recorder.latencies.clear()
+    recorder.statuses.clear()
+    output = io.StringIO()
+    tracemalloc.start()
+    start = time.perf_counter()
+    error = None
+    try:
+        with contextlib.redirect_stdout(output):
+            func(sp)
+    except Exception as e:
+        error = str(e)
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    requests_by_endpoint = Counter(endpoint_key(method, path) for method, path in server.requests)
+    return {
+        'entry_point': name,
+        'error': error,
+        'wall_time_s': round(wall, 3),
+        'requests': len(server.requests),
+        'requests_by_endpoint': dict(sorted(requests_by_endpoint.items())),
+        'rate_limited': recorder.statuses.get(429, 0),
+        'latency_p50_ms': recorder.percentile(50),
+        'latency_p99_ms': recorder.percentile(99),
+        'peak_memory_kb': round(peak / 1024, 1)
+    }
+
+def run_size(num_playlists, args):
+    library = FakeLibrary(num_playlists=num_playlists, num_artists=args.artists,
+                          num_top_tracks=args.top_tracks, seed=args.seed)
+    server = FakeSpotifyServer(library, latency=args.latency, rate_limit_ratio=args.rate_limit_ratio,
+                               retry_after=args.retry_after, seed=args.seed).start()
+    results = []
+    try:
+        for name, func in [('spotify_playlist_creator.main', run_creator),
+                           ('auto_update_daemon cycle', run_daemon_cycle)]:
+            cache_dir = tempfile.mkdtemp(prefix='spotify-bench-')
+            try:
+                for phase in ('cold', 'warm'):
+                    use_cache_dir(cache_dir)
+                    recorder = LatencyRecorder()
+                    sp = create_client(server, recorder, args.requests_per_second)
+                    result = measure(name, func, server, recorder, sp)
+                    result.update({'phase': phase, 'playlists': num_playlists})
+                    results.append(result)
+                    print(f"{num_playlists:>6} playlists  {name:<30} {phase:<5} "
+                          f"{result['requests']:>5} requests  {result['wall_time_s']:>7.3f}s  "
+                          f"p50 {result['latency_p50_ms']}ms  p99 {result['latency_p99_ms']}ms  "
+                          f"peak {result['peak_memory_kb']}KB"
+                          + (f"  ERROR: {result['error']}" if result['error'] else ""))
+            finally:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+    finally:
+        server.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the playlist creator and daemon against a fake Spotify API')
+    parser.add_argument('--playlists', type=int, nargs='+', default=[50, 1000, 10000],
+                        help='Library sizes to run, in number of playlists (default: 50 1000 10000)')
+    parser.add_argument('--artists', type=int, default=1000, help='Number of artists (default: 1000)')
+    parser.add_argument('--top-tracks', type=int, default=500,
+                        help='Top tracks available per time range (default: 500)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Latency added to every response, in seconds (default: 0)')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0,
+                        help='Fraction of requests answered with 429 (default: 0)')
+    parser.add_argument('--retry-after', type=int, default=1,
+                        help='Retry-After sent with injected 429 responses (default: 1)')
+    parser.add_argument('--requests-per-second', type=float, default=1000.0,
+                        help='Client side request pacing (default: 1000, effectively unpaced)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated library')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='Write the results as JSON to this file (default: stdout)')
+    args = parser.parse_args()
+
+    # The daemon logs every track; keep the benchmark output readable
+    logging.disable(logging.CRITICAL)
+    # The pause after creating a playlist waits for Spotify to catch up, which
+    # the fake server doesn't need; it is excluded from the measurements
+    spotify_utils.sleep = lambda seconds: None
+
+    results = []
+    for num_playlists in args.playlists:
+        results.extend(run_size(num_playlists, args))
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'config': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+    if any(result['error'] for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Measure how long the entry points take to start.
+
+Each command runs in a fresh interpreter several times and the median and
+fastest wall times are reported, along with which heavy modules the
+import of each entry point pulls in. Results are printed or written as JSON.
+
+Example:
+    python benchmarks/startup_time.py --runs 20 -o startup.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SRC_DIR = os.path.join(PROJECT_ROOT, 'src')
+
+# Modules that are slow to import and only needed once Spotify is called
+HEAVY_MODULES = ['requests', 'urllib3', 'spotipy', 'dotenv', 'sqlite3', 'http.server']
+
+COMMANDS = {
+    'python (baseline)': [sys.executable, '-c', 'pass'],
+    'import spotify_playlist_creator': [sys.executable, '-c', 'import spotify_playlist_creator'],
+    'import auto_update_daemon': [sys.executable, '-c', 'import auto_update_daemon'],
+    'spotify_playlist_creator.py --help': [sys.executable, os.path.join(SRC_DIR, 'spotify_playlist_creator.py'), '--help'],
+    'auto_update_daemon.py --help': [sys.executable, os.path.join(SRC_DIR, 'auto_update_daemon.py'), '--help'],
+}
+
+def time_command(command, runs):
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 1),
+        'min_ms': round(min(timings) * 1000, 1)
+    }
+
+def loaded_heavy_modules(module):
+    code = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    output = subprocess.run([sys.executable, '-c', code], cwd=PROJECT_ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return output.split()
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the start up time of the entry points')
+    parser.add_argument('--runs', type=int, default=10, help='Runs per command (default: 10)')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='Write the results as JSON to this file (default: stdout)')
+    args = parser.parse_args()
+
+    results = []
+    for name, command in COMMANDS.items():
+        result = {'command': name, **time_command(command, args.runs)}
+        results.append(result)
+        print(f"{name:<40} median {result['median_ms']:>7.1f}ms  min {result['min_ms']:>7.1f}ms", file=sys.stderr)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'results': results,
+        'heavy_modules_on_import': {module: loaded_heavy_modules(module)
+                                    for module in ('spotify_playlist_creator', 'auto_update_daemon')}
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
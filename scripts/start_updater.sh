@@ -12,6 +12,8 @@ PLAYLIST_NAME="My Auto-Updated Top Songs"
 NUM_SONGS=20
 DAYS=30
 UPDATE_INTERVAL=3600  # 1 hour in seconds
+CONFIG_FILE=""
+EXTRA_ARGS=()
 
 # Help message
 show_help() {
@@ -21,6 +23,13 @@ show_help() {
     echo "  -n, --num-songs NUM    Number of songs (default: $NUM_SONGS)"
     echo "  -d, --days NUM         Time range in days (default: $DAYS)"
     echo "  -i, --interval SEC     Update interval in seconds (default: $UPDATE_INTERVAL)"
+    echo "  -c, --config FILE      JSON file with several playlists (overrides -p, -n and -d)"
+    echo "  --min-interval SEC     Shortest interval while playlists keep changing (enables adaptive intervals)"
+    echo "  --max-interval SEC     Longest interval while nothing changes (enables adaptive intervals)"
+    echo "  --history              Build playlists from your recorded plays of exactly the last DAYS days"
+    echo "  --check                Only update playlists whose top tracks changed"
+    echo "  --metrics-port PORT    Serve Prometheus metrics on http://127.0.0.1:PORT/metrics"
+    echo "  --log-format FORMAT    Log format: text or json (default: text)"
     echo "  -h, --help            Show this help message"
 }
 
@@ -43,6 +52,18 @@ while [[ $# -gt 0 ]]; do
             UPDATE_INTERVAL="$2"
             shift 2
             ;;
+        -c|--config)
+            CONFIG_FILE="$2"
+            shift 2
+            ;;
+        --min-interval|--max-interval|--metrics-port|--log-format)
+            EXTRA_ARGS+=("$1" "$2")
+            shift 2
+            ;;
+        --check|--history)
+            EXTRA_ARGS+=("$1")
+            shift
+            ;;
         -h|--help)
             show_help
             exit 0
@@ -59,15 +80,23 @@ done
 cd "$PROJECT_ROOT"
 
 # Start the updater in the background
-nohup python3 src/auto_update_daemon.py "$PLAYLIST_NAME" "$NUM_SONGS" "$DAYS" --interval "$UPDATE_INTERVAL" > logs/spotify_updater.out 2>&1 &
+if [ -n "$CONFIG_FILE" ]; then
+    nohup python3 src/auto_update_daemon.py --config "$CONFIG_FILE" --interval "$UPDATE_INTERVAL" "${EXTRA_ARGS[@]}" > logs/spotify_updater.out 2>&1 &
+else
+    nohup python3 src/auto_update_daemon.py "$PLAYLIST_NAME" "$NUM_SONGS" "$DAYS" --interval "$UPDATE_INTERVAL" "${EXTRA_ARGS[@]}" > logs/spotify_updater.out 2>&1 &
+fi
 
 # Save the process ID
 echo $! > logs/spotify_updater.pid
 
 echo "Spotify playlist updater started with PID $(cat logs/spotify_updater.pid)"
-echo "Playlist: $PLAYLIST_NAME"
-echo "Number of songs: $NUM_SONGS"
-echo "Time range: $DAYS days"
+if [ -n "$CONFIG_FILE" ]; then
+    echo "Config file: $CONFIG_FILE"
+else
+    echo "Playlist: $PLAYLIST_NAME"
+    echo "Number of songs: $NUM_SONGS"
+    echo "Time range: $DAYS days"
+fi
 echo "Update interval: $UPDATE_INTERVAL seconds"
 echo
 echo "Log files:"
@@ -1,140 +1,480 @@
 import sys
 import os
+import json
 import time
 from datetime import datetime
 import argparse
 import logging
+from rate_limit import get_request_scheduler, retry_after_seconds
+from metrics import get_metrics, count_calls, start_metrics_server, JsonFormatter
+from update_schedule import UpdateScheduler
 from spotify_utils import (
+    MAX_TOP_TRACKS,
     create_spotify_client,
     get_top_tracks,
     get_or_create_playlist,
     update_playlist,
+    refresh_token_if_expiring,
+    is_connection_error,
+    reset_client_session,
+    resolve_track_genres,
+    filter_tracks_by_genre,
     validate_track_params,
-    get_time_range_for_days
+    get_time_range_for_days,
+    get_top_tracks_cache,
+    get_genre_cache,
+    probe_top_tracks,
+    playlist_fingerprint,
+    is_playlist_current,
+    sync_listening_history,
+    get_history_top_tracks,
+    get_history_coverage_days,
+    plan_playlist_update,
+    describe_plan,
+    playlist_description
 )
 
 # Get the project root directory
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 LOGS_DIR = os.path.join(PROJECT_ROOT, 'logs')
+LOG_FILE = os.path.join(LOGS_DIR, 'spotify_updater.log')
 
-# Ensure logs directory exists
-os.makedirs(LOGS_DIR, exist_ok=True)
-
-# Set up logging
-log_file = os.path.join(LOGS_DIR, 'spotify_updater.log')
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ]
-)
+def setup_logging(level='INFO', log_format='text'):
+    """Log to logs/spotify_updater.log and to the console, as text or as JSON lines."""
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE),
+            logging.StreamHandler()
+        ]
+    )
+    if log_format == 'json':
+        for handler in logging.getLogger().handlers:
+            handler.setFormatter(JsonFormatter())
 
-def update_playlist_with_retry(playlist_name, num_songs, days, max_retries=3, retry_delay=60):
-    """Update playlist with retry logic."""
-    sp = None
+def load_playlist_specs(config_file):
+    """Load playlist specs from a JSON config file.
+
+    The file looks like:
+        {"playlists": [{"name": "My Top 20", "num_songs": 20, "days": 30},
+                       {"name": "My Rock", "num_songs": 10, "days": 30, "genre": "rock"}]}
+    """
+    with open(config_file, 'r') as f:
+        config = json.load(f)
+    
+    specs = []
+    for entry in config.get('playlists', []):
+        try:
+            name = entry['name']
+            num_songs, days = validate_track_params(int(entry['num_songs']), int(entry['days']))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Invalid playlist spec {entry}: {str(e)}")
+        specs.append({
+            'name': name,
+            'num_songs': num_songs,
+            'days': days,
+            'genre': entry.get('genre')
+        })
+    
+    if not specs:
+        raise ValueError(f"No playlists defined in {config_file}")
+    return specs
+
+def fetch_tracks_for_specs(sp, specs, timings=None, history=False):
+    """Get the top tracks for every spec.
+
+    Specs are grouped by time range so each range is fetched, and its genres
+    resolved, only once no matter how many playlists use it. With history the
+    tracks are computed from the local listening history for each spec's
+    exact number of days instead. Time spent fetching and resolving genres is
+    added to timings if given.
+    Returns a list of track lists in the same order as specs.
+    """
+    metrics = get_metrics()
+    if history:
+        results = []
+        for spec in specs:
+            with metrics.span('genre_resolution' if spec['genre'] else 'fetch', timings):
+                results.append(get_history_top_tracks(sp, spec['num_songs'], spec['days'], spec['genre']))
+        return results
+    
+    groups = {}
+    for i, spec in enumerate(specs):
+        groups.setdefault(get_time_range_for_days(spec['days']), []).append(i)
+    
+    results = [None] * len(specs)
+    for time_range, indexes in groups.items():
+        group = [specs[i] for i in indexes]
+        pool_size = max(spec['num_songs'] * 3 if spec['genre'] else spec['num_songs'] for spec in group)
+        with metrics.span('fetch', timings):
+            pool = get_top_tracks(sp, limit=pool_size, time_range=time_range)
+        
+        genre_specs = [i for i in indexes if specs[i]['genre']]
+        if genre_specs:
+            with metrics.span('genre_resolution', timings):
+                track_genres = resolve_track_genres(sp, pool)
+                filtered = {i: filter_tracks_by_genre(sp, pool, specs[i]['genre'], track_genres)
+                            for i in genre_specs}
+            
+            # Widen the pool once if a genre came up short and more tracks may exist
+            short = any(len(filtered[i]) < specs[i]['num_songs'] for i in genre_specs)
+            if short and len(pool) == pool_size and pool_size < MAX_TOP_TRACKS:
+                with metrics.span('fetch', timings):
+                    pool = get_top_tracks(sp, limit=MAX_TOP_TRACKS, time_range=time_range)
+                with metrics.span('genre_resolution', timings):
+                    track_genres = resolve_track_genres(sp, pool)
+                    filtered = {i: filter_tracks_by_genre(sp, pool, specs[i]['genre'], track_genres)
+                                for i in genre_specs}
+        
+        for i in indexes:
+            tracks = filtered[i] if specs[i]['genre'] else pool
+            results[i] = tracks[:specs[i]['num_songs']]
+    
+    return results
+
+def probe_specs(sp, specs, revalidate=False, history=False):
+    """Return {playlist name: fingerprint} for every spec, probing the first
+    top tracks page once per time range. With history the fingerprint is taken
+    from the local listening history of each spec's window, which costs no request.
+    """
+    probes = {}
+    fingerprints = {}
+    for spec in specs:
+        if history:
+            pool_size = spec['num_songs'] * 3 if spec['genre'] else spec['num_songs']
+            uris = [track.uri for track in get_history_top_tracks(sp, pool_size, spec['days'])]
+            fingerprints[spec['name']] = playlist_fingerprint(f"{spec['days']} days", spec['num_songs'],
+                                                              spec['genre'], uris)
+            continue
+        time_range = get_time_range_for_days(spec['days'])
+        if time_range not in probes:
+            probes[time_range] = probe_top_tracks(sp, time_range, revalidate=revalidate)
+        fingerprints[spec['name']] = playlist_fingerprint(time_range, spec['num_songs'], spec['genre'],
+                                                          probes[time_range])
+    return fingerprints
+
+def record_cycle(metrics, success, duration, timings, calls, user=None):
+    """Export the metrics of a finished cycle and log a summary of it.
+
+    calls holds the API calls of this cycle only (see metrics.count_calls).
+    With user, the last cycle gauges are labeled with it, so the cycles of
+    several users updated by one process don't overwrite each other.
+    """
+    labels = {'user': user} if user is not None else {}
+    result = 'success' if success else 'failure'
+    metrics.inc('daemon_cycles_total', help_text='Daemon cycles by result', result=result)
+    metrics.observe('daemon_cycle_duration_seconds', duration, help_text='Duration of daemon cycles')
+    metrics.set('daemon_last_cycle_duration_seconds', duration, help_text='Duration of the last cycle', **labels)
+    metrics.set('daemon_last_cycle_timestamp_seconds', time.time(), help_text='Unix time the last cycle finished',
+                **labels)
+    metrics.set('daemon_last_cycle_success', int(success), help_text='1 if the last cycle updated every playlist',
+                **labels)
+    metrics.set('daemon_last_cycle_api_calls', calls['calls'], help_text='Spotify API calls made by the last cycle',
+                **labels)
+    # The caches are shared by everything in the process, so their counts are too
+    caches = {'top_tracks': get_top_tracks_cache().stats(), 'genre': get_genre_cache().stats()}
+    for cache, stats in caches.items():
+        for outcome, count in stats.items():
+            metrics.set('cache_lookups', count, help_text='Cache lookups since start by cache and outcome',
+                        cache=cache, outcome=outcome)
+    
+    spans_text = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+    logging.info(
+        f"Cycle {result} in {duration:.2f}s: {calls['calls']} API calls ({calls['retries']} retries, "
+        f"{calls['errors']} errors, {calls['bytes'] / 1024:.0f} KB)" + (f"; {spans_text}" if spans_text else ""),
+        extra={
+            'event': 'cycle',
+            'success': success,
+            'duration': round(duration, 3),
+            'spans': {name: round(seconds, 3) for name, seconds in timings.items()},
+            'api': calls,
+            'caches': caches
+        }
+    )
+
+def update_playlists_with_retry(specs, max_retries=3, retry_delay=60, sp=None, changed=None, check=False,
+                                history=False, user=None):
+    """Update several playlists with retry logic, sharing one client and one
+    top tracks fetch per time range. Only playlists that failed are retried.
+    Pass a long-lived client as sp to reuse its session and token across cycles.
+    The names of playlists that were written to are appended to changed if given.
+    With check, the first top tracks page is probed first and playlists whose
+    fingerprint matches their last update are skipped. With history, new plays
+    are synced into the local listening history and the tracks are taken from it.
+    user labels the last cycle metrics when one process updates several users.
+    Returns True if every playlist was updated or already current.
+    """
+    metrics = get_metrics()
+    timings = {}
+    start = time.perf_counter()
+    success = False
+    with count_calls() as calls:
+        try:
+            success = _update_playlists(specs, max_retries, retry_delay, sp, timings, changed, check, history)
+            return success
+        finally:
+            record_cycle(metrics, success, time.perf_counter() - start, timings, calls, user)
+
+def _update_playlists(specs, max_retries, retry_delay, sp, timings, changed, check, history):
+    metrics = get_metrics()
+    pending = list(specs)
+    if sp is None:
+        sp = create_spotify_client(history=history)
     for attempt in range(max_retries):
+        # Longest Retry-After seen on a rate limited playlist in this attempt
+        retry_after = 0
         try:
-            # Validate parameters
-            num_songs, days = validate_track_params(num_songs, days)
+            refresh_token_if_expiring(sp)
             
-            # Get Spotify client
-            sp = create_spotify_client()
+            if history:
+                with metrics.span('history_sync', timings):
+                    new_plays = sync_listening_history(sp)
+                logging.info(f"Listening history: {new_plays} new plays, "
+                             f"{get_history_coverage_days(sp):.1f} days recorded")
             
-            # Get or create playlist
-            playlist_id = get_or_create_playlist(sp, playlist_name, auto_update=True)
+            with metrics.span('probe', timings):
+                fingerprints = probe_specs(sp, pending, revalidate=check, history=history)
+            if check:
+                current = [spec['name'] for spec in pending
+                           if is_playlist_current(sp, spec['name'], fingerprints[spec['name']])]
+                if current:
+                    logging.info(f"Top tracks unchanged since the last update, skipping: {', '.join(current)}")
+                pending = [spec for spec in pending if spec['name'] not in current]
+                if not pending:
+                    return True
             
-            # Get top tracks
-            time_range = get_time_range_for_days(days)
-            top_tracks = get_top_tracks(sp, limit=num_songs, time_range=time_range)
-            track_uris = [track['uri'] for track in top_tracks]
+            # Fetch everything first, then write all playlists together
+            all_tracks = fetch_tracks_for_specs(sp, pending, timings, history)
             
-            # Update playlist
-            update_playlist(sp, playlist_id, track_uris)
+            failed = []
+            for spec, top_tracks in zip(pending, all_tracks):
+                playlist_name = spec['name']
+                try:
+                    with metrics.span('playlist_lookup', timings):
+                        playlist_id = get_or_create_playlist(sp, playlist_name, auto_update=True)
+                    track_uris = [track.uri for track in top_tracks]
+                    with metrics.span('write', timings):
+                        num_ops = update_playlist(sp, playlist_id, track_uris, fingerprints[playlist_name],
+                                                  playlist_description(auto_update=True))
+                except Exception as e:
+                    logging.error(f"Failed to update playlist '{playlist_name}': {str(e)}")
+                    failed.append(spec)
+                    retry_after = max(retry_after, retry_after_seconds(e) or 0)
+                    if is_connection_error(e):
+                        reset_client_session(sp)
+                    continue
+                
+                if num_ops:
+                    if changed is not None:
+                        changed.append(playlist_name)
+                    logging.info(f"Successfully updated playlist '{playlist_name}' with {len(track_uris)} tracks "
+                                 f"({num_ops} write operations)")
+                else:
+                    logging.info(f"Playlist '{playlist_name}' is already up to date, no changes written")
+                logging.info("Tracks:")
+                for i, track in enumerate(top_tracks, 1):
+                    logging.info(f"{i}. {track.name} - {track.artist_names}")
             
-            logging.info(f"Successfully updated playlist '{playlist_name}' with {len(track_uris)} tracks")
-            logging.info("Tracks:")
-            for i, track in enumerate(top_tracks, 1):
-                artists = ", ".join([artist['name'] for artist in track['artists']])
-                logging.info(f"{i}. {track['name']} - {artists}")
+            stats = get_top_tracks_cache().stats()
+            logging.info(f"Top tracks cache: {stats['hits']} hits, {stats['misses']} misses, "
+                         f"{stats['revalidations']} revalidations")
+            budget = get_request_scheduler().budget()
+            logging.info(f"Request budget: {budget['available']} requests available, "
+                         f"{budget['throttled']} rate limited responses so far")
             
-            return True
+            if not failed:
+                return True
+            pending = failed
+            raise RuntimeError(f"{len(failed)} playlist(s) failed to update")
             
         except Exception as e:
             logging.error(f"Attempt {attempt + 1}/{max_retries} failed: {str(e)}")
+            if is_connection_error(e):
+                logging.info("Connection looks broken, rebuilding the HTTP session")
+                reset_client_session(sp)
             if attempt < max_retries - 1:
-                logging.info(f"Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                # When rate limited, wait as long as Spotify asked instead of the fixed delay
+                delay = max(retry_after, retry_after_seconds(e) or 0) or retry_delay
+                logging.info(f"Retrying in {delay} seconds...")
+                time.sleep(delay)
             else:
                 logging.error("Max retries reached. Update failed.")
                 return False
-        finally:
-            # Close the Spotify client to free up the port
-            if sp is not None:
-                try:
-                    sp._auth_manager.cache_handler.save_token_to_cache(None)
-                    sp = None
-                except:
-                    pass
 
-def main():
-    parser = argparse.ArgumentParser(description='Auto-update Spotify playlist daemon')
-    parser.add_argument('playlist_name', help='Name of the playlist to update')
-    parser.add_argument('num_songs', type=int, help='Number of songs to include')
-    parser.add_argument('days', type=int, help='Time range in days')
+def plan_playlists(specs, sp=None, check=False, history=False):
+    """Plan the update of every playlist like a daemon cycle would, using only read calls.
+
+    The plans (see plan_playlist_update) are logged with the total number of
+    read calls made and write calls the cycle would take, and returned in the
+    order of specs. With check, playlists whose fingerprint matches their last
+    update are left out, as the cycle would skip them.
+    """
+    with count_calls() as calls:
+        return _plan_playlists(specs, sp, check, history, calls)
+
+def _plan_playlists(specs, sp, check, history, calls):
+    if sp is None:
+        sp = create_spotify_client(history=history)
+    if history:
+        logging.info(f"Listening history: {sync_listening_history(sp)} new plays, "
+                     f"{get_history_coverage_days(sp):.1f} days recorded")
+    
+    pending = list(specs)
+    if check:
+        fingerprints = probe_specs(sp, pending, revalidate=True, history=history)
+        current = [spec['name'] for spec in pending
+                   if is_playlist_current(sp, spec['name'], fingerprints[spec['name']])]
+        if current:
+            logging.info(f"Top tracks unchanged since the last update, would skip: {', '.join(current)}")
+        pending = [spec for spec in pending if spec['name'] not in current]
+    
+    plans = []
+    for spec, top_tracks in zip(pending, fetch_tracks_for_specs(sp, pending, history=history)):
+        plan = plan_playlist_update(sp, spec['name'], [track.uri for track in top_tracks],
+                                    playlist_description(auto_update=True))
+        plans.append(plan)
+        for line in describe_plan(plan):
+            logging.info(line)
+    get_top_tracks_cache().save()
+    
+    counts = {action: sum(plan['action'] == action for plan in plans) for action in ('create', 'update', 'unchanged')}
+    logging.info(f"Dry run: {counts['create']} to create, {counts['update']} to update, "
+                 f"{counts['unchanged']} unchanged; {calls['calls']} read calls made, "
+                 f"{sum(plan['writes'] for plan in plans)} write calls to apply")
+    return plans
+
+def update_playlist_with_retry(playlist_name, num_songs, days, max_retries=3, retry_delay=60):
+    """Update playlist with retry logic."""
+    num_songs, days = validate_track_params(num_songs, days)
+    spec = {'name': playlist_name, 'num_songs': num_songs, 'days': days, 'genre': None}
+    return update_playlists_with_retry([spec], max_retries, retry_delay)
+
+def add_cycle_arguments(parser):
+    """Add the scheduling, update, logging and metrics options shared by the
+    daemon and batch_updater.py to parser.
+    """
     parser.add_argument('--interval', type=int, default=3600,
                       help='Update interval in seconds (default: 3600 = 1 hour)')
+    parser.add_argument('--min-interval', type=int, default=None,
+                      help='Shortest interval when playlists keep changing (default: the interval, no adapting)')
+    parser.add_argument('--max-interval', type=int, default=None,
+                      help='Longest interval when nothing changes (default: the interval, no adapting)')
+    parser.add_argument('--jitter', type=float, default=0.1,
+                      help='Randomly shift each run by up to this fraction of the interval (default: 0.1)')
+    parser.add_argument('--max-backoff', type=int, default=None,
+                      help='Longest delay after repeated failed updates, in seconds (default: 8 times the interval)')
     parser.add_argument('--retry-delay', type=int, default=60,
                       help='Delay between retries in seconds (default: 60)')
     parser.add_argument('--max-retries', type=int, default=3,
-                      help='Maximum number of retry attempts (default: 3)')
+                      help='Maximum number of retry attempts per cycle (default: 3)')
+    parser.add_argument('--check', action='store_true',
+                      help='Start each cycle with a one request probe and only update playlists whose top tracks changed')
+    parser.add_argument('--history', action='store_true',
+                      help='Record your plays locally every cycle and build playlists from exactly the last DAYS days')
+    parser.add_argument('--cache-max-age', type=int, default=6 * 3600,
+                      help='Seconds a cached top-tracks page is served without revalidation (default: 21600 = 6 hours)')
+    parser.add_argument('--log-level', type=str.upper, default='INFO',
+                      choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                      help='Logging level (default: INFO)')
+    parser.add_argument('--log-format', choices=['text', 'json'], default='text',
+                      help='Log as plain text or as one JSON object per line (default: text)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                      help='Serve Prometheus metrics on http://127.0.0.1:PORT/metrics (default: off)')
+    parser.add_argument('--metrics-host', type=str, default='127.0.0.1',
+                      help='Address the metrics endpoint listens on (default: 127.0.0.1)')
+
+def main():
+    parser = argparse.ArgumentParser(description='Auto-update Spotify playlist daemon')
+    parser.add_argument('playlist_name', nargs='?', help='Name of the playlist to update')
+    parser.add_argument('num_songs', type=int, nargs='?', help='Number of songs to include')
+    parser.add_argument('days', type=int, nargs='?', help='Time range in days')
+    parser.add_argument('-c', '--config', type=str, default=None,
+                      help='JSON file with several playlists to update (replaces the positional arguments)')
+    parser.add_argument('--dry-run', action='store_true',
+                      help='Plan one cycle with read calls only, log what would be written and exit')
+    add_cycle_arguments(parser)
     
     args = parser.parse_args()
+    setup_logging(args.log_level, args.log_format)
+    
+    if args.config:
+        specs = load_playlist_specs(args.config)
+    elif args.playlist_name and args.num_songs is not None and args.days is not None:
+        num_songs, days = validate_track_params(args.num_songs, args.days)
+        specs = [{'name': args.playlist_name, 'num_songs': num_songs, 'days': days, 'genre': None}]
+    else:
+        parser.error("either --config or playlist_name, num_songs and days are required")
+    
+    get_top_tracks_cache(max_age=args.cache_max_age)
+    
+    # Record every Spotify call made through the shared scheduler
+    get_request_scheduler().add_hook(get_metrics().record_call)
+    if args.metrics_port is not None:
+        start_metrics_server(args.metrics_port, args.metrics_host)
+        logging.info(f"Serving metrics on http://{args.metrics_host}:{args.metrics_port}/metrics")
     
     logging.info(f"Starting Spotify playlist updater daemon")
-    logging.info(f"Playlist: {args.playlist_name}")
-    logging.info(f"Number of songs: {args.num_songs}")
-    logging.info(f"Time range: {args.days} days")
+    for spec in specs:
+        genre_text = f", genre: {spec['genre']}" if spec['genre'] else ""
+        logging.info(f"Playlist: {spec['name']} ({spec['num_songs']} songs, {spec['days']} days{genre_text})")
+    
+    if args.dry_run:
+        plan_playlists(specs, check=args.check, history=args.history)
+        return
+    
     logging.info(f"Update interval: {args.interval} seconds")
     
-    consecutive_failures = 0
+    schedule = UpdateScheduler(
+        args.interval,
+        min_interval=args.min_interval,
+        max_interval=args.max_interval,
+        jitter=args.jitter,
+        max_backoff=args.max_backoff
+    )
+    if schedule.adaptive:
+        logging.info(f"Adaptive interval between {schedule.min_interval} and {schedule.max_interval} seconds")
+    metrics = get_metrics()
+    
+    # One client, session and token for the lifetime of the daemon
+    sp = create_spotify_client(history=args.history)
+    
     while True:
         try:
+            schedule.wait()
             logging.info("\n" + "="*50)
             logging.info(f"Starting playlist update at {datetime.now()}")
             
-            success = update_playlist_with_retry(
-                args.playlist_name,
-                args.num_songs,
-                args.days,
+            changed = []
+            success = update_playlists_with_retry(
+                specs,
                 args.max_retries,
-                args.retry_delay
+                args.retry_delay,
+                sp,
+                changed,
+                check=args.check,
+                history=args.history
             )
             
+            delay = schedule.record(success, changed=bool(changed))
             if success:
-                consecutive_failures = 0
-                logging.info(f"Update completed successfully. Next update in {args.interval} seconds.")
+                logging.info(f"Update completed successfully ({len(changed)} playlist(s) changed). "
+                             f"Next update in {delay:.0f} seconds.")
             else:
-                consecutive_failures += 1
-                logging.error(f"Update failed. Consecutive failures: {consecutive_failures}")
-                
-                # If we've failed too many times, increase the interval temporarily
-                if consecutive_failures > 3:
-                    temp_interval = args.interval * 2
-                    logging.warning(f"Too many consecutive failures. Increasing interval to {temp_interval} seconds.")
-                    time.sleep(temp_interval)
-                    continue
-            
-            time.sleep(args.interval)
+                logging.error(f"Update failed. Consecutive failures: {schedule.failures}. "
+                              f"Next update in {delay:.0f} seconds.")
+            metrics.set('daemon_next_run_delay_seconds', delay, help_text='Seconds until the next scheduled cycle')
+            metrics.set('daemon_interval_seconds', schedule.interval,
+                        help_text='Current update interval after adapting to changes')
             
         except KeyboardInterrupt:
             logging.info("\nStopping Spotify playlist updater daemon")
             sys.exit(0)
         except Exception as e:
+            delay = schedule.record(False)
             logging.error(f"Unexpected error: {str(e)}")
-            logging.info("Continuing in 60 seconds...")
-            time.sleep(60)
+            logging.info(f"Continuing in {delay:.0f} seconds...")
 
 if __name__ == "__main__":
     main()
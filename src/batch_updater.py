@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from rate_limit import get_request_scheduler
+from metrics import get_metrics, start_metrics_server
+from update_schedule import UpdateScheduler
+from auto_update_daemon import (
+    setup_logging,
+    load_playlist_specs,
+    update_playlists_with_retry,
+    add_cycle_arguments
+)
+from spotify_utils import (
+    create_spotify_client,
+    has_cached_token,
+    get_current_user_id,
+    get_top_tracks_cache,
+    get_genre_cache,
+    get_playlist_store,
+    get_playlist_state_store,
+    get_playlist_index,
+    get_listening_history
+)
+
+# Files in every user's directory
+TOKEN_CACHE_NAME = 'spotify_cache'
+PLAYLISTS_NAME = 'playlists.json'
+
+# Users updated at the same time by default
+DEFAULT_WORKERS = 4
+
+# Name of the user whose cycle runs in the current thread, for logging
+_context = threading.local()
+
+class UserLogFilter(logging.Filter):
+    """Add the user being updated by the current thread to log records as record.user."""
+
+    def filter(self, record):
+        record.user = getattr(_context, 'user', None) or '-'
+        return True
+
+def setup_batch_logging(level='INFO', log_format='text'):
+    """Log like the daemon, with the user each line belongs to."""
+    setup_logging(level, log_format)
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(UserLogFilter())
+        if log_format == 'text':
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - [%(user)s] %(message)s'))
+
+def load_users(users_dir):
+    """Load the users to update from users_dir.
+
+    Every subdirectory with a playlists.json is a user named after the
+    directory. playlists.json has the same format as the daemon's --config
+    file, and the user's Spotify token is kept next to it in spotify_cache.
+    Users whose playlists can't be loaded are logged and skipped.
+    """
+    users = []
+    for name in sorted(os.listdir(users_dir)):
+        user_dir = os.path.join(users_dir, name)
+        config_file = os.path.join(user_dir, PLAYLISTS_NAME)
+        if not os.path.isfile(config_file):
+            continue
+        try:
+            specs = load_playlist_specs(config_file)
+        except (OSError, ValueError) as e:
+            logging.error(f"Skipping user '{name}': {str(e)}")
+            continue
+        users.append({
+            'name': name,
+            'token_cache': os.path.join(user_dir, TOKEN_CACHE_NAME),
+            'specs': specs,
+            'client': None
+        })
+    return users
+
+def run_user_cycle(user, max_retries, retry_delay, check=False, history=False):
+    """Run one update cycle for a user and return (success, names of changed playlists).
+
+    Any error is logged and counted as a failed cycle for this user only.
+    The user's client is created on the first cycle and reused afterwards.
+    """
+    _context.user = user['name']
+    changed = []
+    success = False
+    try:
+        if user['client'] is None:
+            if not has_cached_token(user['token_cache'], history):
+                raise RuntimeError(f"No usable token in {user['token_cache']}, log in with --login first"
+                                   + (" (with --history)" if history else ""))
+            user['client'] = create_spotify_client(user['token_cache'], open_browser=False, history=history)
+        success = update_playlists_with_retry(user['specs'], max_retries, retry_delay, user['client'], changed,
+                                              check=check, history=history, user=user['name'])
+    except Exception as e:
+        logging.error(f"Update failed: {str(e)}")
+    finally:
+        get_metrics().inc('batch_user_cycles_total', help_text='Update cycles by user and result',
+                          user=user['name'], result='success' if success else 'failure')
+        _context.user = None
+    return success, changed
+
+def login(users_dir, name, history=False):
+    """Log a user in interactively and store their token in their directory.
+    With history the token also allows reading the listening history.
+    """
+    user_dir = os.path.join(users_dir, name)
+    os.makedirs(user_dir, exist_ok=True)
+    sp = create_spotify_client(os.path.join(user_dir, TOKEN_CACHE_NAME), history=history)
+    print(f"Logged in as {get_current_user_id(sp)}, token stored in {user_dir}")
+
+def run_once(users, executor, args):
+    """Update every user once and return True if all of them succeeded."""
+    results = executor.map(lambda user: run_user_cycle(user, args.max_retries, args.retry_delay,
+                                                       args.check, args.history), users)
+    failed = [user['name'] for user, (success, _) in zip(users, results) if not success]
+    if failed:
+        logging.error(f"{len(failed)} of {len(users)} users failed: {', '.join(failed)}")
+    else:
+        logging.info(f"All {len(users)} users updated")
+    return not failed
+
+def run_forever(users, executor, args):
+    """Update every user on their own schedule, at most args.workers at a time."""
+    schedules = {
+        user['name']: UpdateScheduler(
+            args.interval,
+            min_interval=args.min_interval,
+            max_interval=args.max_interval,
+            jitter=args.jitter,
+            max_backoff=args.max_backoff
+        )
+        for user in users
+    }
+    running = {}
+    while True:
+        for user in users:
+            if user['name'] not in running and schedules[user['name']].seconds_until_next_run() == 0:
+                running[user['name']] = executor.submit(run_user_cycle, user, args.max_retries, args.retry_delay,
+                                                        args.check, args.history)
+
+        waiting = [schedules[user['name']].seconds_until_next_run() for user in users
+                   if user['name'] not in running]
+        timeout = min(waiting) if waiting else None
+        if not running:
+            time.sleep(timeout)
+            continue
+        done, _ = wait(running.values(), timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for name, future in list(running.items()):
+            if future not in done:
+                continue
+            del running[name]
+            success, changed = future.result()
+            schedule = schedules[name]
+            delay = schedule.record(success, changed=bool(changed))
+            if success:
+                logging.info(f"User '{name}' updated ({len(changed)} playlist(s) changed). "
+                             f"Next update in {delay:.0f} seconds.")
+            else:
+                logging.error(f"User '{name}' failed. Consecutive failures: {schedule.failures}. "
+                              f"Next update in {delay:.0f} seconds.")
+
+        budget = get_request_scheduler().budget()
+        get_metrics().set('batch_users_running', len(running), help_text='Users being updated right now')
+        get_metrics().set('batch_request_budget_available', budget['available'],
+                          help_text='Requests that can be sent right now within the shared rate limit')
+
+def main():
+    parser = argparse.ArgumentParser(description='Update the playlists of many Spotify users from one process')
+    parser.add_argument('users_dir', type=str,
+                      help='Directory with one subdirectory per user holding playlists.json and spotify_cache')
+    parser.add_argument('--login', type=str, default=None, metavar='USER',
+                      help='Log USER in through the browser, store their token in USERS_DIR/USER and exit '
+                           '(with --history, also allow reading their listening history)')
+    parser.add_argument('--once', action='store_true',
+                      help='Update every user once and exit, with status 1 if any user failed')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                      help=f'Users updated at the same time (default: {DEFAULT_WORKERS})')
+    add_cycle_arguments(parser)
+
+    args = parser.parse_args()
+    if args.login:
+        login(args.users_dir, args.login, args.history)
+        return
+    setup_batch_logging(args.log_level, args.log_format)
+
+    users = load_users(args.users_dir)
+    if not users:
+        parser.error(f"no users with a {PLAYLISTS_NAME} found in {args.users_dir}")
+
+    # Create the shared caches before the workers start so every thread uses the same ones
+    get_top_tracks_cache(max_age=args.cache_max_age)
+    get_genre_cache()
+    get_playlist_store()
+    get_playlist_state_store()
+    get_playlist_index()
+    if args.history:
+        get_listening_history()
+
+    # All users share one scheduler, and so one rate limit budget for the app
+    get_request_scheduler().add_hook(get_metrics().record_call)
+    if args.metrics_port is not None:
+        start_metrics_server(args.metrics_port, args.metrics_host)
+        logging.info(f"Serving metrics on http://{args.metrics_host}:{args.metrics_port}/metrics")
+
+    logging.info(f"Updating {len(users)} users with {args.workers} workers")
+    executor = ThreadPoolExecutor(max_workers=max(1, args.workers))
+    try:
+        if args.once:
+            sys.exit(0 if run_once(users, executor, args) else 1)
+        run_forever(users, executor, args)
+    except KeyboardInterrupt:
+        logging.info("Stopping batch updater")
+        executor.shutdown(wait=False, cancel_futures=True)
+        sys.exit(0)
+    executor.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import os
+import json
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+# Marks a key deleted in the buffer of pending changes
+_DELETED = object()
+
+def atomic_write_json(path, data):
+    """Write data as JSON to path atomically (temp file + rename), so readers
+    never see a half written file.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+@contextmanager
+def file_lock(path, exclusive=True):
+    """Hold an advisory lock on path + '.lock' across processes."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class JsonStore:
+    """Key/value store kept as a JSON snapshot plus an append-only journal.
+
+    The data is loaded once per process and kept in memory. Changes are
+    buffered until flush(), which appends them to the journal under a file
+    lock, so saving costs the size of the change rather than of the whole
+    store. Once the journal holds more than compact_after entries it is
+    folded back into the snapshot, which is replaced atomically. Changes
+    made by other processes are picked up from the journal on access.
+    A store can be shared between threads.
+    """
+
+    def __init__(self, path, compact_after=200):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.compact_after = compact_after
+        self._data = None
+        self._pending = {}
+        self._snapshot_sig = None
+        self._journal_pos = 0
+        self._journal_entries = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _signature(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _journal_size(self):
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
+
+    def _changed_on_disk(self):
+        """True if the snapshot was replaced or the journal truncated, which needs a full reload."""
+        return (self._data is None or self._signature(self.path) != self._snapshot_sig
+                or self._journal_size() < self._journal_pos)
+
+    def _reload(self):
+        self._data = {}
+        self._snapshot_sig = self._signature(self.path)
+        if self._snapshot_sig is not None:
+            try:
+                with open(self.path, 'r') as f:
+                    self._data = json.load(f)
+            except ValueError:
+                self._data = {}
+        self._journal_pos = 0
+        self._journal_entries = 0
+        self._replay_journal()
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self._journal_pos)
+            while True:
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break  # end of file, or an entry still being written
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = None
+                if entry is not None:
+                    if entry.get('d'):
+                        self._data.pop(entry['k'], None)
+                    else:
+                        self._data[entry['k']] = entry['v']
+                    self._journal_entries += 1
+                self._journal_pos = f.tell()
+
+    def _refresh(self):
+        """Pick up changes written by other processes since the last access."""
+        if self._changed_on_disk():
+            with file_lock(self.path, exclusive=False):
+                self._reload()
+        elif self._journal_size() > self._journal_pos:
+            with file_lock(self.path, exclusive=False):
+                self._replay_journal()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._pending:
+                value = self._pending[key]
+                return default if value is _DELETED else value
+            self._refresh()
+            return self._data.get(key, default)
+
+    def __contains__(self, key):
+        return self.get(key, _DELETED) is not _DELETED
+
+    def to_dict(self):
+        """Return a copy of all entries, including unflushed changes."""
+        with self._lock:
+            self._refresh()
+            data = dict(self._data)
+            for key, value in self._pending.items():
+                if value is _DELETED:
+                    data.pop(key, None)
+                else:
+                    data[key] = value
+            return data
+
+    def set(self, key, value):
+        with self._lock:
+            self._pending[key] = value
+
+    def delete(self, key):
+        with self._lock:
+            self._pending[key] = _DELETED
+
+    def flush(self):
+        """Write buffered changes to the journal, compacting it if it grew too long."""
+        with self._lock:
+            if not self._pending:
+                return
+            with file_lock(self.path, exclusive=True):
+                # Apply whatever other processes wrote first so we don't lose it
+                if self._changed_on_disk():
+                    self._reload()
+                else:
+                    self._replay_journal()
+
+                lines = []
+                for key, value in self._pending.items():
+                    if value is _DELETED:
+                        self._data.pop(key, None)
+                        lines.append(json.dumps({'k': key, 'd': 1}))
+                    else:
+                        self._data[key] = value
+                        lines.append(json.dumps({'k': key, 'v': value}))
+                self._pending = {}
+
+                if self._journal_entries + len(lines) > self.compact_after:
+                    atomic_write_json(self.path, self._data)
+                    open(self.journal_path, 'w').close()
+                    self._snapshot_sig = self._signature(self.path)
+                    self._journal_pos = 0
+                    self._journal_entries = 0
+                    return
+
+                with open(self.journal_path, 'ab') as f:
+                    f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._journal_pos = f.tell()
+                self._journal_entries += len(lines)
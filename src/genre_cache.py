@@ -0,0 +1,79 @@
+import os
+import json
+import time
+import threading
+from cache_store import atomic_write_json
+
+class GenreCache:
+    """On-disk cache of artist genres with per-entry TTL and size-bounded eviction.
+
+    Entries are stored as {artist_id: {"genres": [...], "fetched_at": timestamp}}.
+    When the cache grows past max_entries, the oldest entries are evicted first.
+    The cache can be shared between threads.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                # A corrupt cache is not fatal, just refetch everything
+                self._entries = {}
+
+    def get(self, artist_id):
+        """Return the cached genres for an artist, or None if missing or expired."""
+        with self._lock:
+            self._load()
+            entry = self._entries.get(artist_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.time() - entry['fetched_at'] > self.ttl:
+                del self._entries[artist_id]
+                self._dirty = True
+                self.misses += 1
+                return None
+            self.hits += 1
+            return set(entry['genres'])
+
+    def set(self, artist_id, genres):
+        """Store the genres for an artist."""
+        with self._lock:
+            self._load()
+            self._entries[artist_id] = {'genres': sorted(genres), 'fetched_at': time.time()}
+            self._dirty = True
+
+    def stats(self):
+        """Return the hit/miss counters."""
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _evict(self):
+        overflow = len(self._entries) - self.max_entries
+        if overflow <= 0:
+            return
+        oldest = sorted(self._entries, key=lambda a: self._entries[a]['fetched_at'])
+        for artist_id in oldest[:overflow]:
+            del self._entries[artist_id]
+
+    def save(self):
+        """Write the cache to disk if anything changed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._evict()
+            atomic_write_json(self.path, self._entries)
+            self._dirty = False
@@ -0,0 +1,66 @@
+import re
+
+# Define genre variations and related genres
+DEFAULT_GENRE_VARIATIONS = {
+    'pop': {'pop', 'dance pop', 'pop dance', 'electropop'},  # but not k-pop
+    'rock': {'rock', 'modern rock', 'alternative rock', 'indie rock'},
+    'rap': {'rap', 'melodic rap', 'hip hop', 'trap', 'drill', 'brooklyn drill', 'new york drill'},
+    'hip hop': {'hip hop', 'rap', 'melodic rap', 'trap'},
+    'electronic': {'electronic', 'edm', 'electro', 'dance'},
+}
+
+# Genres that compound partial matches must never match (e.g. "pop" in "k-pop")
+EXCLUDED_GENRES = ('k-pop', 'j-pop')
+
+def build_genre_index(track_genres):
+    """Build an inverted index {lowercased genre: [track positions]} from a list of genre sets."""
+    index = {}
+    for position, genres in enumerate(track_genres):
+        for genre in genres:
+            index.setdefault(genre.lower(), []).append(position)
+    return index
+
+class GenreMatcher:
+    """Matcher for one requested genre, compiled once and reused for every track.
+
+    A track genre matches if it is the requested genre or one of its variations
+    (a set lookup), or, for compound genres such as "pop rock", if it contains
+    the requested genre without being one of the excluded genres (a regex).
+    """
+
+    def __init__(self, genre, variations=None):
+        if variations is None:
+            variations = DEFAULT_GENRE_VARIATIONS
+        self.genre = genre.lower()
+        self.accepted = {self.genre} | set(variations.get(self.genre, ()))
+        self.partial = re.compile(re.escape(self.genre)) if ' ' in self.genre else None
+        self.excluded = re.compile('|'.join(re.escape(g) for g in EXCLUDED_GENRES))
+        self._seen = {}
+
+    def matches(self, genre):
+        """Return True if a single (lowercased) track genre matches."""
+        result = self._seen.get(genre)
+        if result is None:
+            result = genre in self.accepted or bool(
+                self.partial is not None
+                and self.partial.search(genre)
+                and not self.excluded.search(genre)
+            )
+            self._seen[genre] = result
+        return result
+
+    def matches_any(self, genres):
+        """Return True if any of a track's genres matches."""
+        return any(self.matches(genre.lower()) for genre in genres)
+
+    def match_index(self, index):
+        """Return the sorted track positions matched in a genre index from build_genre_index."""
+        positions = set()
+        for genre, genre_positions in index.items():
+            if self.matches(genre):
+                positions.update(genre_positions)
+        return sorted(positions)
+
+    def filter(self, tracks, track_genres):
+        """Return the tracks whose genres match, keeping their order."""
+        return [tracks[i] for i in self.match_index(build_genre_index(track_genres))]
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timezone
+from track_model import Track, get_artist, parse_track
+
+# Spotify returns at most 50 recently played tracks per request
+RECENTLY_PLAYED_LIMIT = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    uri TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    artists TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS plays (
+    user_id TEXT NOT NULL,
+    played_at INTEGER NOT NULL,
+    track_id INTEGER NOT NULL REFERENCES tracks(id),
+    PRIMARY KEY (user_id, played_at)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS cursors (
+    user_id TEXT PRIMARY KEY,
+    after INTEGER NOT NULL
+);
+"""
+
+def parse_played_at(value):
+    """Convert Spotify's played_at timestamp (e.g. 2024-05-01T12:34:56.789Z) to epoch milliseconds."""
+    value = value.rstrip('Z')
+    for fmt in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return int(parsed.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    raise ValueError(f"Unrecognized played_at timestamp: {value}")
+
+class ListeningHistory:
+    """Append-only SQLite store of the user's plays.
+
+    Tracks are stored once with only the fields playlists need, and every play
+    is a (user, played_at, track) row clustered by user and time, so the plays
+    of any window are one index range. Spotify only remembers the last 50
+    plays, so the history is as complete as the polling is frequent.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            import sqlite3
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def cursor(self, user_id):
+        """Return the played_at (epoch ms) of the newest ingested play, or None."""
+        with self._lock:
+            row = self._connect().execute('SELECT after FROM cursors WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def add_plays(self, user_id, items):
+        """Store items from the recently played endpoint, ignoring plays already stored.
+        Returns the number of new plays.
+        """
+        if not items:
+            return 0
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                track_ids = {}
+                for item in items:
+                    track = parse_track(item['track'])
+                    if track.uri in track_ids:
+                        continue
+                    artists = json.dumps([{'id': artist.id, 'name': artist.name} for artist in track.artists])
+                    conn.execute('INSERT OR IGNORE INTO tracks (uri, name, artists) VALUES (?, ?, ?)',
+                                 (track.uri, track.name, artists))
+                    track_ids[track.uri] = conn.execute('SELECT id FROM tracks WHERE uri = ?',
+                                                        (track.uri,)).fetchone()[0]
+                rows = [(user_id, parse_played_at(item['played_at']), track_ids[item['track']['uri']])
+                        for item in items]
+                before = conn.total_changes
+                conn.executemany('INSERT OR IGNORE INTO plays (user_id, played_at, track_id) VALUES (?, ?, ?)',
+                                 rows)
+                added = conn.total_changes - before
+                newest = max(row[1] for row in rows)
+                conn.execute(
+                    'INSERT INTO cursors (user_id, after) VALUES (?, ?) '
+                    'ON CONFLICT(user_id) DO UPDATE SET after = MAX(after, excluded.after)',
+                    (user_id, newest)
+                )
+        return added
+
+    def ingest(self, sp, user_id):
+        """Fetch the plays newer than the stored cursor and store them.
+        Returns the number of new plays.
+        """
+        after = self.cursor(user_id)
+        added = 0
+        while True:
+            page = sp.current_user_recently_played(limit=RECENTLY_PLAYED_LIMIT, after=after)
+            items = [item for item in page.get('items') or [] if item.get('track')]
+            added += self.add_plays(user_id, items)
+            newest = self.cursor(user_id)
+            if len(items) < RECENTLY_PLAYED_LIMIT or newest == after:
+                return added
+            after = newest
+
+    def oldest_play(self, user_id):
+        """Return the played_at (epoch ms) of the oldest stored play, or None."""
+        with self._lock:
+            row = self._connect().execute('SELECT MIN(played_at) FROM plays WHERE user_id = ?',
+                                          (user_id,)).fetchone()
+        return row[0]
+
+    def top_tracks(self, user_id, days, limit=None, now=None):
+        """Return the user's most played tracks over exactly the last days days.
+
+        Tracks are ordered by play count, then by most recent play, and come
+        back as Track objects.
+        """
+        now = time.time() if now is None else now
+        since = int((now - days * 86400) * 1000)
+        query = (
+            'SELECT t.uri, t.name, t.artists FROM ('
+            '  SELECT track_id, COUNT(*) AS plays, MAX(played_at) AS last_played FROM plays'
+            '  WHERE user_id = ? AND played_at >= ? GROUP BY track_id'
+            ') AS p JOIN tracks AS t ON t.id = p.track_id '
+            'ORDER BY p.plays DESC, p.last_played DESC'
+        )
+        params = [user_id, since]
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        with self._lock:
+            rows = self._connect().execute(query, params).fetchall()
+        return [Track(uri, name, tuple([get_artist(artist['id'], artist['name']) for artist in json.loads(artists)]))
+                for uri, name, artists in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
@@ -0,0 +1,205 @@
+import json
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Histogram buckets in seconds, from a fast cached call to a slow cycle
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# API call counts of the count_calls block running in the current context
+_call_counts = contextvars.ContextVar('call_counts', default=None)
+
+@contextmanager
+def count_calls():
+    """Count the Spotify calls recorded by record_call inside this block.
+
+    Yields a dict with the number of calls, errors, retries and bytes received,
+    filled in as calls finish. Only calls made from this context are counted,
+    which includes the worker threads of spotify_io (they run in a copy of it)
+    but not other cycles running at the same time.
+    """
+    counts = {'calls': 0, 'errors': 0, 'retries': 0, 'bytes': 0}
+    token = _call_counts.set(counts)
+    try:
+        yield counts
+    finally:
+        _call_counts.reset(token)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+class Metrics:
+    """Thread safe counters, gauges and histograms rendered in the Prometheus text format.
+
+    Every Spotify call is recorded through record_call (see RequestScheduler.add_hook)
+    and daemon cycles are split into timed spans with span().
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._types = {}
+        self._help = {}
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def _declare(self, name, kind, help_text):
+        if name not in self._types:
+            self._types[name] = kind
+            self._help[name] = help_text
+
+    def inc(self, name, value=1, help_text='', **labels):
+        """Add value to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'counter', help_text)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, help_text='', **labels):
+        """Set a gauge."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'gauge', help_text)
+            self._gauges[key] = value
+
+    def observe(self, name, value, help_text='', **labels):
+        """Record a value in a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._declare(name, 'histogram', help_text)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def counter_total(self, name):
+        """Return the sum of a counter over all of its labels."""
+        with self._lock:
+            return sum(value for (metric, _), value in self._counters.items() if metric == name)
+
+    def record_call(self, endpoint, status, latency, retries, size):
+        """Record one Spotify call; status is None when no response was received."""
+        self.inc('spotify_api_requests_total', help_text='Spotify API calls by endpoint and final status',
+                 endpoint=endpoint, status='error' if status is None else str(status))
+        self.observe('spotify_api_request_duration_seconds', latency,
+                     help_text='Time per Spotify API call including retries', endpoint=endpoint)
+        if status is None or status >= 400:
+            self.inc('spotify_api_errors_total', help_text='Spotify API calls that failed or returned an error status',
+                     endpoint=endpoint)
+        if retries:
+            self.inc('spotify_api_retries_total', retries, help_text='Retried Spotify API requests',
+                     endpoint=endpoint)
+        if size:
+            self.inc('spotify_api_response_bytes_total', size, help_text='Bytes received from the Spotify API',
+                     endpoint=endpoint)
+        counts = _call_counts.get()
+        if counts is not None:
+            with self._lock:
+                counts['calls'] += 1
+                counts['errors'] += status is None or status >= 400
+                counts['retries'] += retries
+                counts['bytes'] += size
+
+    @contextmanager
+    def span(self, name, timings=None):
+        """Time a block of a cycle; the duration is also added to timings[name] if given."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe('daemon_span_duration_seconds', elapsed,
+                         help_text='Time spent in each stage of a daemon cycle', span=name)
+            if timings is not None:
+                timings[name] = timings.get(name, 0.0) + elapsed
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = []
+            for name in sorted(self._types):
+                kind = self._types[name]
+                lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+                if kind == 'histogram':
+                    for (metric, labels), (counts, total, count) in sorted(self._histograms.items()):
+                        if metric != name:
+                            continue
+                        for bound, bucket_count in zip(self.buckets, counts):
+                            bucket_labels = labels + (('le', repr(bound)),)
+                            lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {bucket_count}')
+                        lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {count}')
+                        lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+                        lines.append(f'{name}_count{_format_labels(labels)} {count}')
+                else:
+                    values = self._counters if kind == 'counter' else self._gauges
+                    for (metric, labels), value in sorted(values.items()):
+                        if metric == name:
+                            lines.append(f'{name}{_format_labels(labels)} {value}')
+            return '\n'.join(lines) + '\n'
+
+_metrics = None
+
+def get_metrics():
+    """Return the process-wide metrics registry, creating it on first use."""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
+
+def start_metrics_server(port, host='127.0.0.1', metrics=None):
+    """Serve metrics on http://host:port/metrics from a background thread.
+    Returns the server; call shutdown() on it to stop serving.
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    metrics = metrics or get_metrics()
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Attributes every LogRecord has; anything else was passed with extra={...}
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line, including fields passed with extra={...}."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage().strip()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
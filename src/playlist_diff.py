@@ -0,0 +1,145 @@
+from bisect import bisect_left
+
+# Spotify accepts at most 100 items per add/remove/replace request
+MAX_ITEMS_PER_REQUEST = 100
+
+def _chunks(items, size=MAX_ITEMS_PER_REQUEST):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def _longest_increasing_subsequence(values):
+    """Return the set of values forming a longest strictly increasing subsequence."""
+    tails = []       # tails[k] = index of the smallest tail of a run of length k+1
+    tail_values = []
+    previous = [None] * len(values)
+    for i, value in enumerate(values):
+        k = bisect_left(tail_values, value)
+        if k > 0:
+            previous[i] = tails[k - 1]
+        if k == len(tails):
+            tails.append(i)
+            tail_values.append(value)
+        else:
+            tails[k] = i
+            tail_values[k] = value
+
+    result = set()
+    i = tails[-1] if tails else None
+    while i is not None:
+        result.add(values[i])
+        i = previous[i]
+    return result
+
+def replace_ops(desired):
+    """Return the ops that overwrite the whole playlist with desired."""
+    chunks = list(_chunks(desired)) or [[]]
+    ops = [{'op': 'replace', 'uris': chunks[0]}]
+    position = len(chunks[0])
+    for chunk in chunks[1:]:
+        ops.append({'op': 'add', 'uris': chunk, 'position': position})
+        position += len(chunk)
+    return ops
+
+def diff_playlist(current, desired):
+    """Compute the write operations that turn the current URI list into the desired one.
+
+    None in current stands for an item without a URI (a track that is no
+    longer available); it can't be removed by URI, so the playlist is replaced.
+
+    Returns a list of ops, each a dict with an 'op' key:
+    - {'op': 'remove', 'uris': [...]}
+    - {'op': 'move', 'range_start': i, 'insert_before': j}
+    - {'op': 'add', 'uris': [...], 'position': p}
+    - {'op': 'replace', 'uris': [...]}
+    Every op is exactly one API call. An empty list means nothing changed. If
+    the incremental ops would cost more calls than overwriting the playlist,
+    the replace ops are returned instead.
+    """
+    if current == desired:
+        return []
+
+    # Removing by URI drops every occurrence, so duplicates can't be diffed safely
+    if None in current or len(set(current)) != len(current) or len(set(desired)) != len(desired):
+        return replace_ops(desired)
+
+    desired_set = set(desired)
+    current_set = set(current)
+    ops = []
+
+    # 1. Remove tracks that are no longer wanted
+    removed = [uri for uri in current if uri not in desired_set]
+    for chunk in _chunks(removed):
+        ops.append({'op': 'remove', 'uris': chunk})
+
+    # 2. Reorder the remaining tracks, moving only those outside the longest
+    # run that is already in the right relative order
+    working = [uri for uri in current if uri in desired_set]
+    target = [uri for uri in desired if uri in current_set]
+    rank = {uri: i for i, uri in enumerate(target)}
+    in_place = _longest_increasing_subsequence([rank[uri] for uri in working])
+    for i, uri in enumerate(target):
+        if i in in_place:
+            continue
+        start = working.index(uri)
+        insert_before = working.index(target[i - 1]) + 1 if i > 0 else 0
+        if insert_before in (start, start + 1):
+            continue
+        ops.append({'op': 'move', 'range_start': start, 'insert_before': insert_before})
+        working.pop(start)
+        working.insert(insert_before - 1 if insert_before > start else insert_before, uri)
+
+    # 3. Insert new tracks as contiguous runs at their final positions
+    i = 0
+    while i < len(desired):
+        if desired[i] in current_set:
+            i += 1
+            continue
+        start = i
+        while i < len(desired) and desired[i] not in current_set:
+            i += 1
+        for offset, chunk in enumerate(_chunks(desired[start:i])):
+            ops.append({'op': 'add', 'uris': chunk,
+                        'position': start + offset * MAX_ITEMS_PER_REQUEST})
+
+    replacement = replace_ops(desired)
+    if len(ops) > len(replacement):
+        return replacement
+    return ops
+
+def apply_playlist_ops(sp, playlist_id, ops):
+    """Send the ops to Spotify. Returns the snapshot_id after the last write, or None."""
+    snapshot_id = None
+    for op in ops:
+        if op['op'] == 'replace':
+            result = sp.playlist_replace_items(playlist_id, op['uris'])
+        elif op['op'] == 'remove':
+            result = sp.playlist_remove_all_occurrences_of_items(playlist_id, op['uris'])
+        elif op['op'] == 'move':
+            result = sp.playlist_reorder_items(playlist_id, op['range_start'], op['insert_before'])
+        elif op['op'] == 'add':
+            result = sp.playlist_add_items(playlist_id, op['uris'], position=op['position'])
+        else:
+            raise ValueError(f"Unknown playlist op: {op['op']}")
+        if result and 'snapshot_id' in result:
+            snapshot_id = result['snapshot_id']
+    return snapshot_id
+
+def summarize_ops(ops):
+    """Describe ops in a few words, e.g. 'remove 3 tracks, 2 moves, add 3 tracks'."""
+    if not ops:
+        return "no changes"
+    tracks = {}
+    calls = {}
+    for op in ops:
+        calls[op['op']] = calls.get(op['op'], 0) + 1
+        tracks[op['op']] = tracks.get(op['op'], 0) + len(op.get('uris', ()))
+    parts = []
+    if 'replace' in calls:
+        parts.append(f"replace all tracks with {tracks['replace']}")
+    if 'remove' in calls:
+        parts.append(f"remove {tracks['remove']} tracks")
+    if 'move' in calls:
+        parts.append(f"{calls['move']} moves")
+    if 'add' in calls:
+        parts.append(f"add {tracks['add']} tracks")
+    return ", ".join(parts)
@@ -0,0 +1,174 @@
+import os
+import copy
+import json
+import time
+import threading
+from urllib.parse import quote
+from cache_store import atomic_write_json
+
+def normalize_playlist_name(name):
+    """Normalize a playlist name for lookups: case and extra whitespace are ignored."""
+    return ' '.join(name.split()).casefold()
+
+class PlaylistIndex:
+    """Local index of the user's playlists stored on disk.
+
+    For each user it keeps {playlist_id: {name, owner, collaborative, snapshot_id}}
+    in the order Spotify lists them, plus an in-memory map from normalized name to
+    playlist IDs so lookups need no network call. The index is rebuilt when it is
+    older than max_age, and kept up to date incrementally in between. The index
+    can be shared between threads.
+
+    Every user's index is kept in their own file in directory, loaded on the
+    user's first lookup, so saving only rewrites the files of users whose index
+    changed.
+    """
+
+    def __init__(self, directory, max_age=24 * 3600):
+        self.directory = directory
+        self.max_age = max_age
+        # user ID -> their index, or None if they have none yet
+        self._users = {}
+        self._by_name = {}
+        self._dirty = set()
+        self._lock = threading.RLock()
+        # Held while writing files, so saves don't hold up lookups but still land in order
+        self._save_lock = threading.Lock()
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, quote(str(user_id), safe='') + '.json')
+
+    def _user(self, user_id):
+        """Return the user's index, loading their file on first use, or None."""
+        with self._lock:
+            if user_id in self._users:
+                return self._users[user_id]
+            user = None
+            path = self._path(user_id)
+            if os.path.exists(path):
+                try:
+                    with open(path, 'r') as f:
+                        user = json.load(f)
+                except (OSError, ValueError):
+                    user = None
+            self._users[user_id] = user
+            if user is not None:
+                self._reindex(user_id)
+            return user
+
+    def _reindex(self, user_id):
+        by_name = {}
+        for playlist_id, entry in self._users[user_id]['playlists'].items():
+            by_name.setdefault(normalize_playlist_name(entry['name']), []).append(playlist_id)
+        self._by_name[user_id] = by_name
+
+    def is_fresh(self, user_id):
+        """Return True if the user's index exists and is younger than max_age."""
+        user = self._user(user_id)
+        return user is not None and time.time() - user['built_at'] <= self.max_age
+
+    def checked_recently(self, user_id, max_age):
+        """Return True if the user's index was built or checked for new playlists
+        less than max_age seconds ago.
+        """
+        user = self._user(user_id)
+        if user is None:
+            return False
+        return time.time() - user.get('checked_at', user['built_at']) <= max_age
+
+    def find(self, user_id, name):
+        """Return the ID of the first playlist called name that the user can modify, or None."""
+        with self._lock:
+            user = self._user(user_id)
+            if user is None:
+                return None
+            playlists = user['playlists']
+            for playlist_id in self._by_name[user_id].get(normalize_playlist_name(name), []):
+                entry = playlists[playlist_id]
+                if entry['owner'] == user_id or entry['collaborative']:
+                    return playlist_id
+            return None
+
+    def get(self, user_id, playlist_id):
+        """Return the indexed entry for a playlist, or None."""
+        user = self._user(user_id)
+        return user['playlists'].get(playlist_id) if user is not None else None
+
+    @staticmethod
+    def _entry(playlist):
+        return {
+            'name': playlist['name'],
+            'owner': (playlist.get('owner') or {}).get('id'),
+            'collaborative': playlist.get('collaborative', False),
+            'snapshot_id': playlist.get('snapshot_id')
+        }
+
+    def rebuild(self, user_id, playlists):
+        """Replace the user's index with a full list of playlist objects from the API."""
+        with self._lock:
+            now = time.time()
+            self._users[user_id] = {
+                'built_at': now,
+                'checked_at': now,
+                'playlists': {playlist['id']: self._entry(playlist) for playlist in playlists if playlist}
+            }
+            self._reindex(user_id)
+            self._dirty.add(user_id)
+
+    def add(self, user_id, playlist):
+        """Add or replace a single playlist object from the API, as the user's newest playlist."""
+        self.add_newest(user_id, [playlist], checked=False)
+
+    def add_newest(self, user_id, playlists, checked=True):
+        """Put playlist objects from the API in front of the user's index, the way
+        Spotify lists the newest playlists first. With checked, the index counts
+        as checked for new playlists now.
+        """
+        with self._lock:
+            user = self._user(user_id)
+            if user is None:
+                return
+            if playlists:
+                newest = {playlist['id']: self._entry(playlist) for playlist in playlists if playlist}
+                user['playlists'] = {**newest, **{playlist_id: entry for playlist_id, entry in
+                                                  user['playlists'].items() if playlist_id not in newest}}
+                self._reindex(user_id)
+            if checked:
+                user['checked_at'] = time.time()
+            self._dirty.add(user_id)
+
+    def update(self, user_id, playlist_id, **fields):
+        """Update fields (e.g. name or snapshot_id) of an indexed playlist."""
+        with self._lock:
+            entry = self.get(user_id, playlist_id)
+            if entry is None:
+                return
+            changed = {key: value for key, value in fields.items() if entry.get(key) != value}
+            if not changed:
+                return
+            entry.update(changed)
+            self._dirty.add(user_id)
+            if 'name' in changed:
+                self._reindex(user_id)
+
+    def remove(self, user_id, playlist_id):
+        """Drop a playlist that no longer exists or can't be modified."""
+        with self._lock:
+            user = self._user(user_id)
+            if user is not None and user['playlists'].pop(playlist_id, None) is not None:
+                self._reindex(user_id)
+                self._dirty.add(user_id)
+
+    def save(self):
+        """Write the files of the users whose index changed."""
+        with self._save_lock:
+            with self._lock:
+                snapshots = {user_id: copy.deepcopy(self._users[user_id]) for user_id in self._dirty}
+                self._dirty.clear()
+            for user_id, data in snapshots.items():
+                try:
+                    atomic_write_json(self._path(user_id), data)
+                except BaseException:
+                    with self._lock:
+                        self._dirty.add(user_id)
+                    raise
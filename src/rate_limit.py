@@ -0,0 +1,198 @@
+import os
+import re
+import time
+import random
+import threading
+from urllib.parse import urlparse
+
+# Spotify enforces its limit over a rolling 30 second window without
+# publishing the exact number; these defaults stay well below what apps
+# in development mode are typically allowed.
+DEFAULT_REQUESTS_PER_SECOND = 3.0
+DEFAULT_BURST = 30
+
+# Status codes that are retried by the scheduler
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_ID_SEGMENT = re.compile(r'/(playlists|users|artists|albums|tracks|shows|episodes)/[^/]+')
+
+def endpoint_key(method, url):
+    """Return a stable endpoint name for a request, e.g. 'GET /playlists/{id}/tracks'."""
+    path = urlparse(url).path
+    if path.startswith('/v1/'):
+        path = path[3:]
+    path = _ID_SEGMENT.sub(r'/\1/{id}', path)
+    return f"{method.upper()} {path}"
+
+def retry_after_seconds(error):
+    """Return the Retry-After delay carried by an HTTP response or SpotifyException, or None."""
+    headers = getattr(error, 'headers', None) or {}
+    value = headers.get('Retry-After')
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """Token bucket refilled at a constant rate, used to pace outgoing requests."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self):
+        """Return how many requests can be sent right now without waiting."""
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def acquire(self):
+        """Take one token, sleeping until one is available."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class RequestScheduler:
+    """Central scheduler for Spotify requests.
+
+    Every request takes a token from a shared bucket. A 429 response pauses all
+    requests for its Retry-After delay (Spotify's limit is app wide), and 429s
+    without the header or 5xx responses back off exponentially with jitter per
+    endpoint. Only the failing request is retried. A Retry-After longer than
+    max_retry_after is not waited out here; the response is returned so the
+    caller can give up for now, and later requests still honour the pause.
+
+    Hooks added with add_hook are called after every call with
+    (endpoint, status, latency, retries, size); status is None if no response
+    was received and latency covers the whole call, retries included.
+    """
+
+    def __init__(self, requests_per_second=None, burst=None, max_retries=5, base_delay=1.0, max_delay=60.0,
+                 max_retry_after=300.0):
+        if requests_per_second is None:
+            requests_per_second = float(os.getenv("SPOTIFY_REQUESTS_PER_SECOND", DEFAULT_REQUESTS_PER_SECOND))
+        if burst is None:
+            burst = int(os.getenv("SPOTIFY_REQUEST_BURST", DEFAULT_BURST))
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.throttled = 0
+        self._paused_until = 0.0
+        self._endpoint_failures = {}
+        self._endpoint_paused_until = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """Call hook(endpoint, status, latency, retries, size) after every call."""
+        self._hooks.append(hook)
+
+    def _backoff(self, endpoint):
+        failures = self._endpoint_failures.get(endpoint, 0)
+        delay = min(self.max_delay, self.base_delay * (2 ** failures))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _wait_until_allowed(self, endpoint):
+        while True:
+            with self._lock:
+                until = max(self._paused_until, self._endpoint_paused_until.get(endpoint, 0.0))
+            wait = until - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def execute(self, endpoint, send):
+        """Send a request through the scheduler and return its response.
+
+        send is called with no arguments and must return a requests.Response.
+        After max_retries the last response is returned as is.
+        """
+        if not self._hooks:
+            return self._execute(endpoint, send)
+
+        start = time.perf_counter()
+        attempts = 0
+        response = None
+
+        def counted_send():
+            nonlocal attempts
+            attempts += 1
+            return send()
+
+        try:
+            response = self._execute(endpoint, counted_send)
+            return response
+        finally:
+            latency = time.perf_counter() - start
+            status = response.status_code if response is not None else None
+            size = len(response.content or b'') if response is not None else 0
+            for hook in self._hooks:
+                hook(endpoint, status, latency, max(0, attempts - 1), size)
+
+    def _execute(self, endpoint, send):
+        for attempt in range(self.max_retries + 1):
+            self._wait_until_allowed(endpoint)
+            self.bucket.acquire()
+            response = send()
+
+            if response.status_code not in RETRY_STATUS_CODES:
+                with self._lock:
+                    self._endpoint_failures.pop(endpoint, None)
+                return response
+            if attempt == self.max_retries:
+                return response
+
+            with self._lock:
+                retry_after = retry_after_seconds(response) if response.status_code == 429 else None
+                if retry_after is not None:
+                    self.throttled += 1
+                    self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                else:
+                    delay = self._backoff(endpoint)
+                    self._endpoint_paused_until[endpoint] = time.monotonic() + delay
+                self._endpoint_failures[endpoint] = self._endpoint_failures.get(endpoint, 0) + 1
+            if retry_after is not None and retry_after > self.max_retry_after:
+                return response
+            print(f"Warning: {endpoint} returned {response.status_code}, "
+                  f"retrying ({attempt + 1}/{self.max_retries})")
+            response.close()
+        return response
+
+    def budget(self):
+        """Return the remaining request budget.
+
+        'available' is how many requests can be sent immediately, 'paused_for'
+        how long all requests are held back by a Retry-After, and 'throttled'
+        how many 429 responses have been received so far.
+        """
+        with self._lock:
+            paused_for = max(0.0, self._paused_until - time.monotonic())
+        return {
+            'available': int(self.bucket.available()),
+            'paused_for': round(paused_for, 1),
+            'throttled': self.throttled
+        }
+
+_scheduler = None
+
+def get_request_scheduler():
+    """Return the process-wide request scheduler, creating it on first use."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RequestScheduler()
+    return _scheduler
@@ -0,0 +1,15 @@
+import requests
+from rate_limit import endpoint_key
+
+class ScheduledSession(requests.Session):
+    """requests.Session that sends every request through a RequestScheduler."""
+
+    def __init__(self, scheduler):
+        super().__init__()
+        self.scheduler = scheduler
+
+    def request(self, method, url, *args, **kwargs):
+        return self.scheduler.execute(
+            endpoint_key(method, url),
+            lambda: super(ScheduledSession, self).request(method, url, *args, **kwargs)
+        )
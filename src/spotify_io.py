@@ -0,0 +1,107 @@
+import os
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from rate_limit import get_request_scheduler
+
+# Default number of Spotify requests allowed in flight at once
+DEFAULT_MAX_CONCURRENCY = 8
+
+def get_max_concurrency():
+    """Return the concurrency limit, configurable with SPOTIFY_MAX_CONCURRENCY."""
+    try:
+        return max(1, int(os.getenv("SPOTIFY_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)))
+    except ValueError:
+        return DEFAULT_MAX_CONCURRENCY
+
+def build_session(max_concurrency=None, scheduler=None):
+    """Build a pooled HTTP session able to keep one connection per concurrent request.
+
+    Every request goes through the request scheduler, which paces requests and
+    retries 429 and 5xx responses, so the adapter only retries failed connections.
+    """
+    # requests takes a while to import, so it is only loaded once a client is built
+    import requests
+    from urllib3.util.retry import Retry
+    from scheduled_session import ScheduledSession
+    
+    pool_size = max_concurrency or get_max_concurrency()
+    retry = Retry(
+        total=3,
+        connect=None,
+        read=False,
+        respect_retry_after_header=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE'])
+    )
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=retry
+    )
+    session = ScheduledSession(scheduler or get_request_scheduler())
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def run_concurrently(func, args_list, max_workers=None, return_exceptions=False):
+    """Call func(*args) for every tuple in args_list with bounded concurrency.
+
+    Results are returned in the same order as args_list. If return_exceptions
+    is True, a failing call puts its exception in the results instead of
+    raising, like asyncio.gather.
+    """
+    args_list = list(args_list)
+    if not args_list:
+        return []
+
+    def call(args):
+        try:
+            return func(*args)
+        except Exception as e:
+            if return_exceptions:
+                return e
+            raise
+
+    workers = min(max_workers or get_max_concurrency(), len(args_list))
+    if workers == 1:
+        return [call(args) for args in args_list]
+    # Each call runs in a copy of the caller's context so per-cycle metrics follow it
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, call, args) for args in args_list]
+        return [future.result() for future in futures]
+
+def iter_prefetched(func, args_iter, prefetch=1, return_exceptions=False):
+    """Yield func(*args) for every tuple from args_iter, in order, keeping up to
+    prefetch calls running ahead of the consumer.
+
+    Calls are only started as results are consumed, so when the consumer stops
+    early at most prefetch calls were made in vain; those not started yet are
+    cancelled and those already running are waited for, so none is still
+    running once the generator is closed. With return_exceptions a failing
+    call yields its exception.
+    """
+    args_iter = iter(args_iter)
+    prefetch = max(1, prefetch)
+    executor = ThreadPoolExecutor(max_workers=prefetch)
+    pending = deque()
+
+    def submit():
+        args = next(args_iter, None)
+        if args is not None:
+            pending.append(executor.submit(contextvars.copy_context().run, func, *args))
+
+    try:
+        for _ in range(prefetch):
+            submit()
+        while pending:
+            future = pending.popleft()
+            submit()
+            try:
+                result = future.result()
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                result = e
+            yield result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 import sys
 import argparse
+import logging
 from datetime import datetime
+from rate_limit import get_request_scheduler
+from metrics import get_metrics
 from spotify_utils import (
     create_spotify_client,
     get_top_tracks,
@@ -10,7 +13,16 @@ from spotify_utils import (
     validate_track_params,
     get_time_range_for_days,
     print_track_list,
-    get_available_genres
+    get_available_genres,
+    probe_top_tracks,
+    playlist_fingerprint,
+    is_playlist_current,
+    sync_listening_history,
+    get_history_top_tracks,
+    get_history_coverage_days,
+    plan_playlist_update,
+    print_plan,
+    playlist_description
 )
 
 def main():
@@ -23,15 +35,30 @@ def main():
                       help='Filter songs by genre (e.g., "rock", "pop", "hip hop")')
     parser.add_argument('-l', '--list-genres', action='store_true',
                       help='List all available genres in your top tracks')
+    parser.add_argument('--check', action='store_true',
+                      help='Probe the first page of top tracks and exit without changes if the playlist is current')
+    parser.add_argument('--history', action='store_true',
+                      help='Record your recent plays locally and use exactly the last DAYS days of them '
+                           'instead of Spotify\'s top tracks')
+    parser.add_argument('--dry-run', action='store_true',
+                      help='Show what would be created or changed and how many write calls it takes, without writing')
+    parser.add_argument('--log-level', type=str.upper, default='WARNING',
+                      choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                      help='Logging level, DEBUG shows how each track matched the genre filter (default: WARNING)')
     
     args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format='%(message)s')
     
     try:
         # Validate parameters
         num_songs, days = validate_track_params(args.num_songs, args.days)
         
+        if args.dry_run:
+            # Count the read calls the plan takes
+            get_request_scheduler().add_hook(get_metrics().record_call)
+        
         # Get Spotify client
-        sp = create_spotify_client()
+        sp = create_spotify_client(history=args.history)
         
         # Get time range
         time_range = get_time_range_for_days(days)
@@ -46,15 +73,6 @@ def main():
                 print(f"- {genre}")
             sys.exit(0)
         
-        # Get top tracks with genre filter to validate genre before creating playlist
-        if args.genre:
-            print(f"\nValidating genre '{args.genre}'...")
-            test_tracks = get_top_tracks(sp, limit=num_songs, time_range=time_range, genre=args.genre)
-            if not test_tracks:
-                print(f"\nNo tracks found matching the genre '{args.genre}'.")
-                print("Try using --list-genres to see available genres.")
-                sys.exit(1)
-        
         # Generate default playlist name if not provided
         if args.name is None:
             timeframe = "4 weeks" if days <= 28 else "6 months" if days <= 180 else "all time"
@@ -64,23 +82,72 @@ def main():
         else:
             playlist_name = args.name
         
+        if args.history:
+            new_plays = sync_listening_history(sp)
+            coverage = get_history_coverage_days(sp)
+            print(f"\nListening history: {new_plays} new plays, {coverage:.1f} days recorded")
+            if coverage < days:
+                print(f"Note: Your history only covers {coverage:.1f} of the {days} days so far")
+            
+            def fetch_tracks(limit, genre=None):
+                return get_history_top_tracks(sp, limit=limit, days=days, genre=genre)
+            
+            pool_size = num_songs * 3 if args.genre else num_songs
+            pool_uris = [track.uri for track in fetch_tracks(pool_size)]
+            if not pool_uris:
+                print(f"\nNo plays recorded in the last {days} days yet.")
+                sys.exit(1)
+            fingerprint = playlist_fingerprint(f"{days} days", num_songs, args.genre, pool_uris)
+        else:
+            def fetch_tracks(limit, genre=None):
+                return get_top_tracks(sp, limit=limit, time_range=time_range, genre=genre)
+            
+            # Compare the first page of top tracks with what the playlist was last built from
+            fingerprint = playlist_fingerprint(time_range, num_songs, args.genre,
+                                               probe_top_tracks(sp, time_range, revalidate=args.check))
+        if args.check and is_playlist_current(sp, playlist_name, fingerprint):
+            print(f"\nTop tracks unchanged since '{playlist_name}' was last updated, nothing to do.")
+            sys.exit(0)
+        
+        # Get top tracks with genre filter to validate genre before creating playlist
+        if args.genre:
+            print(f"\nValidating genre '{args.genre}'...")
+            test_tracks = fetch_tracks(num_songs, genre=args.genre)
+            if not test_tracks:
+                print(f"\nNo tracks found matching the genre '{args.genre}'.")
+                print("Try using --list-genres to see available genres.")
+                sys.exit(1)
+        
+        if args.dry_run:
+            top_tracks = test_tracks if args.genre else fetch_tracks(num_songs)
+            plan = plan_playlist_update(sp, playlist_name, [track.uri for track in top_tracks],
+                                        playlist_description())
+            print_plan(plan)
+            print_track_list(top_tracks, "Tracks the playlist would have:")
+            reads = get_metrics().counter_total('spotify_api_requests_total')
+            print(f"\nDry run: {reads} read calls made, nothing written. "
+                  f"Applying the plan takes {plan['writes']} write calls.")
+            sys.exit(0)
+        
         # Get or create playlist
         playlist_id = get_or_create_playlist(sp, playlist_name)
         
         # Get top tracks (we already have them if genre was specified)
         if not args.genre:
             print("\nFetching your top tracks...")
-            top_tracks = get_top_tracks(sp, limit=num_songs, time_range=time_range)
+            top_tracks = fetch_tracks(num_songs)
         else:
             top_tracks = test_tracks
         
         if args.genre and len(top_tracks) < num_songs:
             print(f"\nNote: Only found {len(top_tracks)} tracks matching the genre '{args.genre}'")
         
-        track_uris = [track['uri'] for track in top_tracks]
+        track_uris = [track.uri for track in top_tracks]
         
         # Update playlist
-        update_playlist(sp, playlist_id, track_uris)
+        num_ops = update_playlist(sp, playlist_id, track_uris, fingerprint, playlist_description())
+        if num_ops == 0:
+            print("\nPlaylist already up to date, no changes written.")
         
         print(f"\nCreated playlist: {playlist_name}")
         print(f"URL: https://open.spotify.com/playlist/{playlist_id}")
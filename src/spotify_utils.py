@@ -1,10 +1,22 @@
 import os
 import json
+import time
+import hashlib
+import logging
+import weakref
+from contextlib import closing
+from itertools import chain, islice
 from datetime import datetime
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
-from dotenv import load_dotenv
 from time import sleep
+from genre_cache import GenreCache
+from genre_matcher import GenreMatcher, DEFAULT_GENRE_VARIATIONS
+from top_tracks_cache import TopTracksCache
+from playlist_diff import diff_playlist, apply_playlist_ops, summarize_ops
+from cache_store import JsonStore
+from playlist_index import PlaylistIndex, normalize_playlist_name
+from spotify_io import build_session, run_concurrently, iter_prefetched, get_max_concurrency
+from listening_history import ListeningHistory
+from track_model import parse_tracks
 
 # Get the project root directory
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -13,91 +25,367 @@ PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 CONFIG_DIR = os.path.join(PROJECT_ROOT, 'config')
 CACHE_DIR = os.path.join(PROJECT_ROOT, 'cache')
 PLAYLIST_CACHE_FILE = os.path.join(CACHE_DIR, 'playlist_cache.json')
+PLAYLIST_STATE_FILE = os.path.join(CACHE_DIR, 'playlist_state.json')
+PLAYLIST_INDEX_DIR = os.path.join(CACHE_DIR, 'playlist_index')
+USER_PROFILE_FILE = os.path.join(CACHE_DIR, 'user_profiles.json')
 SPOTIFY_CACHE_FILE = os.path.join(CACHE_DIR, 'spotify_cache')
+GENRE_CACHE_FILE = os.path.join(CACHE_DIR, 'genre_cache.json')
+TOP_TRACKS_CACHE_DIR = os.path.join(CACHE_DIR, 'top_tracks_cache')
+LISTENING_HISTORY_FILE = os.path.join(CACHE_DIR, 'listening_history.db')
 ENV_FILE = os.path.join(CONFIG_DIR, '.env')
+GENRE_VARIATIONS_FILE = os.path.join(CONFIG_DIR, 'genres.json')
 
-def create_spotify_client():
-    """Create and return an authenticated Spotify client."""
+logger = logging.getLogger(__name__)
+
+# Permissions requested from every user
+SPOTIFY_SCOPE = "user-top-read playlist-modify-public playlist-modify-private"
+
+# Extra permission only requested when the listening history is used, so
+# tokens granted without it keep working
+HISTORY_SCOPE = "user-read-recently-played"
+
+# Refresh the access token when it has less than this many seconds left
+TOKEN_REFRESH_MARGIN = 300
+
+# Spotify's "Get Several Artists" endpoint accepts at most 50 IDs per request
+ARTIST_BATCH_SIZE = 50
+
+# Top tracks page size, the most Spotify returns per request
+TOP_TRACKS_PAGE_SIZE = 50
+
+# Spotify ranks at most this many top tracks per time range
+MAX_TOP_TRACKS = 500
+
+# A playlist name missing from the index only makes us look for new playlists
+# on Spotify if the index wasn't built or checked in this many seconds
+PLAYLIST_INDEX_RECHECK_AGE = 300
+
+# A playlist is fully updated at least this often in check mode, even if its
+# probe fingerprint still matches, to catch changes beyond the first page
+CHECK_MAX_AGE = 24 * 3600
+
+_genre_cache = None
+_top_tracks_cache = None
+_playlist_index = None
+_playlist_store = None
+_playlist_state_store = None
+_user_profile_store = None
+_listening_history = None
+_genre_variations = None
+_genre_matchers = {}
+_user_ids = weakref.WeakKeyDictionary()
+
+def get_scope(history=False):
+    """Return the permissions a run needs; history adds the recently played tracks."""
+    return f"{SPOTIFY_SCOPE} {HISTORY_SCOPE}" if history else SPOTIFY_SCOPE
+
+def create_spotify_client(token_cache_file=None, open_browser=True, history=False):
+    """Create and return an authenticated Spotify client.
+
+    The user's token is kept in token_cache_file (default: cache/spotify_cache).
+    With history the client also asks for the permission to read recently
+    played tracks. Without a cached token covering the permissions the user is
+    asked to log in, so clients that must not block should check
+    has_cached_token first.
+    """
+    # Imported here so commands that never talk to Spotify start quickly
+    import spotipy
+    from spotipy.oauth2 import SpotifyOAuth
+    from dotenv import load_dotenv
+    
     load_dotenv(ENV_FILE)
+    os.makedirs(CACHE_DIR, exist_ok=True)
     
-    scope = "user-top-read playlist-modify-public playlist-modify-private"
     auth_manager = SpotifyOAuth(
         client_id=os.getenv("SPOTIFY_CLIENT_ID"),
         client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
         redirect_uri=os.getenv("SPOTIFY_REDIRECT_URI"),
-        scope=scope,
-        open_browser=True,
-        cache_path=SPOTIFY_CACHE_FILE,
+        scope=get_scope(history),
+        open_browser=open_browser,
+        cache_path=token_cache_file or SPOTIFY_CACHE_FILE,
         requests_timeout=10,
         requests_session=True  # Use a session to properly close connections
     )
-    return spotipy.Spotify(auth_manager=auth_manager)
+    # One pooled session so concurrent requests reuse open connections
+    return spotipy.Spotify(
+        auth_manager=auth_manager,
+        requests_session=build_session(get_max_concurrency())
+    )
 
-def get_top_tracks(sp, limit=50, time_range='short_term', genre=None):
-    """Get user's top tracks, optionally filtered by genre.
-    time_range options: short_term (4 weeks), medium_term (6 months), long_term (all time)
+def has_cached_token(token_cache_file, history=False):
+    """Return True if token_cache_file holds a refreshable token with every scope
+    the run needs (see get_scope), so a client can be created from it without an
+    interactive login.
     """
-    all_tracks = []
-    offset = 0
-    max_tracks = 50  # Spotify API limit is 50 tracks per request
-    max_attempts = 10  # Maximum number of attempts to find enough tracks
-    
-    # If genre filter is specified, get more tracks initially
-    target_tracks = limit * 3 if genre else limit
+    try:
+        with open(token_cache_file, 'r') as f:
+            token = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return (bool(token.get('refresh_token'))
+            and set(get_scope(history).split()) <= set(token.get('scope', '').split()))
+
+def refresh_token_if_expiring(sp, margin=TOKEN_REFRESH_MARGIN):
+    """Refresh the client's access token ahead of time if it expires within margin seconds.
+    This keeps a long-lived client from hitting an expired token in the middle of a cycle.
+    """
+    auth_manager = sp.auth_manager
+    if auth_manager is None:
+        return
+    token = auth_manager.cache_handler.get_cached_token()
+    if token and token.get('refresh_token') and token['expires_at'] - time.time() < margin:
+        auth_manager.refresh_access_token(token['refresh_token'])
+
+def is_connection_error(error):
+    """Return True if the error means the HTTP connection itself is broken."""
+    import requests
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+def reset_client_session(sp):
+    """Replace the client's HTTP session with a fresh one, keeping the client and its token."""
+    try:
+        sp._session.close()
+    except Exception:
+        pass
+    sp._session = build_session(get_max_concurrency())
+
+def get_user_profile_store():
+    """Return the process-wide token -> user ID store, loading it on first use."""
+    global _user_profile_store
+    if _user_profile_store is None:
+        _user_profile_store = JsonStore(USER_PROFILE_FILE)
+    return _user_profile_store
+
+def _token_key(sp):
+    """Return a hash identifying the client's login: its refresh token, or its
+    access token for clients created with a fixed token. None if there is none.
+    """
+    if sp.auth_manager is not None:
+        token = sp.auth_manager.cache_handler.get_cached_token() or {}
+        secret = token.get('refresh_token')
+    else:
+        secret = getattr(sp, '_auth', None)
+    return hashlib.sha1(secret.encode('utf-8')).hexdigest() if secret else None
+
+def get_current_user_id(sp):
+    """Return the current user's ID, fetching it only once per client and login.
+
+    The ID is also stored on disk under a hash of the token, so later runs
+    with the same token don't ask for the profile again.
+    """
+    if sp not in _user_ids:
+        key = _token_key(sp)
+        store = get_user_profile_store()
+        user_id = store.get(key) if key else None
+        if user_id is None:
+            user_id = sp.current_user()['id']
+            if key:
+                store.set(key, user_id)
+                store.flush()
+        _user_ids[sp] = user_id
+    return _user_ids[sp]
+
+def get_top_tracks_cache(max_age=None):
+    """Return the process-wide top-tracks page cache, loading it on first use.
+    If max_age is given, it replaces the cache's freshness window (in seconds).
+    """
+    global _top_tracks_cache
+    if _top_tracks_cache is None:
+        _top_tracks_cache = TopTracksCache(TOP_TRACKS_CACHE_DIR)
+    if max_age is not None:
+        _top_tracks_cache.max_age = max_age
+    return _top_tracks_cache
+
+def fetch_top_tracks_page(sp, time_range, offset, limit, revalidate=False):
+    """Fetch one page of the user's top tracks through the page cache.
+
+    Fresh pages are returned without a network call unless revalidate is set.
+    Stale pages with an ETag are revalidated with If-None-Match, and anything
+    else is fetched normally.
+    """
+    cache = get_top_tracks_cache()
+    user_id = get_current_user_id(sp)
+    page, etag, fresh = cache.lookup(user_id, time_range, offset, limit)
+    if page is not None and fresh and not revalidate:
+        cache.record('hits')
+        return page
     
-    while len(all_tracks) < target_tracks:
+    headers = sp._auth_headers()
+    if page is not None and etag:
+        headers['If-None-Match'] = etag
+    response = sp._session.get(
+        sp.prefix + 'me/top/tracks',
+        params={'limit': limit, 'offset': offset, 'time_range': time_range},
+        headers=headers,
+        proxies=sp.proxies,
+        timeout=sp.requests_timeout
+    )
+    if response.status_code == 304 and page is not None:
+        cache.record('revalidations')
+        cache.touch(user_id, time_range, offset, limit)
+        return page
+    if response.status_code >= 400:
+        # Raised the way spotipy raises its errors, so callers can read e.g. Retry-After from it
+        from spotipy import SpotifyException
         try:
-            results = sp.current_user_top_tracks(
-                limit=max_tracks,
-                offset=offset,
-                time_range=time_range
-            )
-            
-            if not results['items']:
-                break
-                
-            all_tracks.extend(results['items'])
-            offset += max_tracks
-            
-            # Stop if we've made too many attempts
-            if offset >= max_tracks * max_attempts:
-                break
-                
-        except Exception as e:
-            print(f"Warning: Error fetching tracks at offset {offset}: {str(e)}")
-            break
+            message = response.json()['error']['message']
+        except (ValueError, KeyError, TypeError):
+            message = response.reason
+        raise SpotifyException(response.status_code, -1, f"{response.url}:\n {message}", headers=response.headers)
     
-    # Apply genre filter if specified
+    cache.record('misses')
+    page = response.json()
+    page = {'items': parse_tracks(page['items']), 'total': page.get('total')}
+    cache.store(user_id, time_range, offset, limit, page, response.headers.get('ETag'))
+    return page
+
+def iter_top_tracks_pages(sp, time_range, max_tracks=MAX_TOP_TRACKS, prefetch=1):
+    """Yield the user's top tracks a page at a time, as lists of Track.
+
+    Up to prefetch pages are fetched ahead, so the next page is on its way
+    while the caller works on the current one. Iteration ends after the last
+    page, and closing the generator early stops fetching. A failed page ends
+    the iteration with a warning.
+    """
+    # Resolve the user ID before fanning out so it's only requested once
+    get_current_user_id(sp)
+    offsets = range(0, min(max_tracks, MAX_TOP_TRACKS), TOP_TRACKS_PAGE_SIZE)
+    pages = iter_prefetched(
+        fetch_top_tracks_page,
+        ((sp, time_range, offset, TOP_TRACKS_PAGE_SIZE) for offset in offsets),
+        prefetch=prefetch,
+        return_exceptions=True
+    )
+    with closing(pages):
+        for offset, page in zip(offsets, pages):
+            if isinstance(page, Exception):
+                print(f"Warning: Error fetching tracks at offset {offset}: {str(page)}")
+                return
+            yield page['items']
+            if len(page['items']) < TOP_TRACKS_PAGE_SIZE:
+                return
+
+def iter_tracks_with_genres(sp, pages):
+    """Yield (track, genres) for every track, resolving the genres of a page at a time."""
+    for tracks in pages:
+        yield from zip(tracks, resolve_track_genres(sp, tracks))
+
+def _match_genres(matcher, tracks_with_genres):
+    """Yield (track, matched) for every (track, genres), logging at DEBUG how each track matched."""
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug(f"Looking for genre '{matcher.genre}'")
+    for track, genres in tracks_with_genres:
+        matched = matcher.matches_any(genres)
+        if debug:
+            logger.debug(f"Track: {track.name} - {track.artist_names} | Genres: {sorted(genres)}"
+                         f"{' | Match found' if matched else ''}")
+        yield track, matched
+
+def iter_genre_matches(tracks_with_genres, genre):
+    """Yield the tracks whose genres match genre."""
+    for track, matched in _match_genres(get_genre_matcher(genre), tracks_with_genres):
+        if matched:
+            yield track
+
+def get_top_tracks(sp, limit=50, time_range='short_term', genre=None):
+    """Get user's top tracks, optionally filtered by genre.
+    time_range options: short_term (4 weeks), medium_term (6 months), long_term (all time)
+
+    Tracks stream through page fetching, genre resolution, filtering and
+    trimming, so fetching stops as soon as limit tracks have been found.
+    """
     if genre:
-        filtered_tracks = filter_tracks_by_genre(sp, all_tracks, genre)
-        
-        # If we don't have enough tracks and there might be more available,
-        # keep fetching until we do or run out of tracks
-        while (len(filtered_tracks) < limit and 
-               offset < max_tracks * max_attempts):
-            try:
-                results = sp.current_user_top_tracks(
-                    limit=max_tracks,
-                    offset=offset,
-                    time_range=time_range
-                )
-                
-                if not results['items']:
-                    break
-                    
-                new_tracks = filter_tracks_by_genre(sp, results['items'], genre)
-                filtered_tracks.extend(new_tracks)
-                offset += max_tracks
-                
-            except Exception as e:
-                print(f"Warning: Error fetching tracks at offset {offset}: {str(e)}")
-                break
-        
-        tracks = filtered_tracks[:limit]  # Trim to requested limit
+        # Expect about a third of the tracks to match and keep that many pages
+        # in flight, but at least the next one while the current one is filtered
+        prefetch = min(max(2, -(-limit * 3 // TOP_TRACKS_PAGE_SIZE)), get_max_concurrency())
+        pages = iter_top_tracks_pages(sp, time_range, prefetch=prefetch)
+        tracks = iter_genre_matches(iter_tracks_with_genres(sp, pages), genre)
     else:
-        tracks = all_tracks[:limit]
+        # Every page is needed, so fetch them all at once within the concurrency limit
+        pages = iter_top_tracks_pages(sp, time_range, max_tracks=limit,
+                                      prefetch=min(-(-limit // TOP_TRACKS_PAGE_SIZE), get_max_concurrency()))
+        tracks = chain.from_iterable(pages)
+    
+    with closing(pages):
+        result = list(islice(tracks, limit))
     
-    return tracks
+    get_top_tracks_cache().save()
+    return result
+
+def probe_top_tracks(sp, time_range, revalidate=True):
+    """Return the URIs of the first page of top tracks, the cheapest sign of a ranking change.
+    With revalidate the page is checked with Spotify even if it is cached, which
+    costs a single request (a 304 if it hasn't changed).
+    """
+    cache = get_top_tracks_cache()
+    page = fetch_top_tracks_page(sp, time_range, 0, TOP_TRACKS_PAGE_SIZE, revalidate=revalidate)
+    cache.save()
+    return [track.uri for track in page['items']]
+
+def playlist_fingerprint(time_range, num_songs, genre, probe_uris):
+    """Hash the playlist parameters and the ordered probe URIs into a fingerprint."""
+    data = json.dumps([time_range, num_songs, (genre or '').lower(), probe_uris])
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+def playlist_description(auto_update=False):
+    """Return the description of the playlists this tool writes, dated today."""
+    desc = "Auto-updated playlist of top songs" if auto_update else "Your top songs playlist"
+    return f"{desc}. Last updated: {datetime.now().strftime('%Y-%m-%d')}"
+
+def is_known_playlist(user_id, playlist_id):
+    """Return True if this tool has written to the playlist as user_id before,
+    so it is known to exist and be writable without asking Spotify.
+    """
+    state = get_playlist_state_store().get(playlist_id)
+    return state is not None and state.get('user_id') == user_id
+
+def is_playlist_current(sp, playlist_name, fingerprint, max_age=CHECK_MAX_AGE):
+    """Return True if the playlist was last updated from the same fingerprint less
+    than max_age seconds ago. Only local state is read, no request is made.
+    """
+    playlist_id = get_playlist_store().get(playlist_cache_key(get_current_user_id(sp), playlist_name))
+    if playlist_id is None:
+        return False
+    state = get_playlist_state_store().get(playlist_id)
+    return (state is not None and state.get('fingerprint') == fingerprint
+            and time.time() - state.get('updated_at', 0) <= max_age)
+
+def get_listening_history():
+    """Return the process-wide listening history store, opening it on first use."""
+    global _listening_history
+    if _listening_history is None:
+        _listening_history = ListeningHistory(LISTENING_HISTORY_FILE)
+    return _listening_history
+
+def sync_listening_history(sp):
+    """Store the plays made since the last sync and return how many there were."""
+    return get_listening_history().ingest(sp, get_current_user_id(sp))
+
+def get_history_top_tracks(sp, limit=50, days=28, genre=None):
+    """Get the user's most played tracks over exactly the last days days from the
+    local listening history, optionally filtered by genre. Call sync_listening_history
+    first to include the latest plays.
+    """
+    history = get_listening_history()
+    user_id = get_current_user_id(sp)
+    if not genre:
+        return history.top_tracks(user_id, days, limit)
+    
+    # Like get_top_tracks, look at three times as many tracks as needed and
+    # only go through the whole window if the genre is still short
+    candidates = history.top_tracks(user_id, days, limit * 3)
+    tracks = filter_tracks_by_genre(sp, candidates, genre)
+    if len(tracks) < limit and len(candidates) == limit * 3:
+        tracks = filter_tracks_by_genre(sp, history.top_tracks(user_id, days), genre)
+    return tracks[:limit]
+
+def get_history_coverage_days(sp):
+    """Return how many days back the local listening history goes, or 0 if it is empty."""
+    oldest = get_listening_history().oldest_play(get_current_user_id(sp))
+    if oldest is None:
+        return 0
+    return (time.time() - oldest / 1000) / 86400
 
 def get_time_range_for_days(days):
     """Convert number of days to Spotify time range."""
@@ -119,179 +407,417 @@ def validate_track_params(num_songs, days):
     
     return num_songs, days
 
+def playlist_cache_key(user_id, playlist_name):
+    """Return the playlist store key of a user's playlist, so users can reuse names."""
+    return f"{user_id}/{playlist_name}"
+
+def get_playlist_store():
+    """Return the process-wide playlist (user, name) -> ID store, loading it on first use."""
+    global _playlist_store
+    if _playlist_store is None:
+        _playlist_store = JsonStore(PLAYLIST_CACHE_FILE)
+    return _playlist_store
+
+def get_playlist_state_store():
+    """Return the process-wide playlist ID -> snapshot state store, loading it on first use."""
+    global _playlist_state_store
+    if _playlist_state_store is None:
+        _playlist_state_store = JsonStore(PLAYLIST_STATE_FILE)
+    return _playlist_state_store
+
+def _save_store(store, data):
+    """Write only the entries of data that differ from the store."""
+    current = store.to_dict()
+    for key, value in data.items():
+        if current.get(key) != value:
+            store.set(key, value)
+    for key in current.keys() - data.keys():
+        store.delete(key)
+    store.flush()
+
 def load_playlist_cache():
     """Load cached playlist ID from file."""
-    if os.path.exists(PLAYLIST_CACHE_FILE):
-        with open(PLAYLIST_CACHE_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+    return get_playlist_store().to_dict()
 
 def save_playlist_cache(cache):
     """Save playlist ID to cache file."""
-    # Ensure cache directory exists
-    os.makedirs(os.path.dirname(PLAYLIST_CACHE_FILE), exist_ok=True)
-    with open(PLAYLIST_CACHE_FILE, 'w') as f:
-        json.dump(cache, f)
+    _save_store(get_playlist_store(), cache)
 
-def get_or_create_playlist(sp, playlist_name, auto_update=False):
-    """Get existing playlist or create a new one."""
-    user_id = sp.current_user()['id']
-    
-    # Check cache first
-    cache = load_playlist_cache()
-    if playlist_name in cache:
-        playlist_id = cache[playlist_name]
-        try:
-            # Verify the playlist still exists and we can modify it
-            playlist = sp.playlist(playlist_id)
-            if playlist['name'].lower() == playlist_name.lower():
-                print(f"\nFound existing playlist: {playlist_name}")
-                desc = "Auto-updated playlist of top songs" if auto_update else "Your top songs playlist"
-                sp.playlist_change_details(playlist_id, 
-                    description=f"{desc}. Last updated: {datetime.now().strftime('%Y-%m-%d')}")
-                return playlist_id
-        except:
-            # If there's any error, remove from cache and continue
-            del cache[playlist_name]
-            save_playlist_cache(cache)
-    
-    # Search through user's playlists
-    offset = 0
+def get_playlist_index():
+    """Return the process-wide playlist index, loading it on first use."""
+    global _playlist_index
+    if _playlist_index is None:
+        _playlist_index = PlaylistIndex(PLAYLIST_INDEX_DIR)
+    return _playlist_index
+
+def build_playlist_index(sp, user_id):
+    """Fetch all of the user's playlists into the local playlist index.
+    The first page gives the total, the remaining pages are fetched concurrently.
+    """
     limit = 50
+    first = sp.current_user_playlists(limit=limit, offset=0)
+    pages = run_concurrently(
+        sp.current_user_playlists,
+        [(limit, offset) for offset in range(limit, first['total'], limit)]
+    )
+    playlists = list(first['items'])
+    for page in pages:
+        playlists.extend(page['items'])
     
+    index = get_playlist_index()
+    index.rebuild(user_id, playlists)
+    index.save()
+    print(f"\nIndexed {len(playlists)} playlists")
+
+def refresh_playlist_index(sp, user_id):
+    """Add the playlists created since the index was built to the local index.
+    Spotify lists the newest playlists first, so pages are only fetched until
+    one with an already indexed playlist, usually just the first.
+    """
+    index = get_playlist_index()
+    limit = 50
+    offset = 0
+    new = []
     while True:
-        results = sp.current_user_playlists(limit=limit, offset=offset)
-        if not results['items']:
-            break
-            
-        print(f"\nChecking playlists {offset+1} to {offset+len(results['items'])}")
-        for playlist in results['items']:
-            print(f"- {playlist['name']} (ID: {playlist['id']})")
-            if playlist['name'].lower() == playlist_name.lower():
-                print(f"\nFound existing playlist: {playlist_name}")
-                try:
-                    desc = "Auto-updated playlist of top songs" if auto_update else "Your top songs playlist"
-                    sp.playlist_change_details(playlist['id'], 
-                        description=f"{desc}. Last updated: {datetime.now().strftime('%Y-%m-%d')}")
-                    # Save to cache
-                    cache[playlist_name] = playlist['id']
-                    save_playlist_cache(cache)
-                    return playlist['id']
-                except Exception as e:
-                    print(f"Cannot modify playlist: {str(e)}")
-                    continue
-        
-        if len(results['items']) < limit:
+        page = sp.current_user_playlists(limit=limit, offset=offset)
+        items = [playlist for playlist in page['items'] if playlist]
+        known = next((i for i, playlist in enumerate(items)
+                      if index.get(user_id, playlist['id']) is not None), None)
+        if known is not None:
+            new.extend(items[:known])
             break
+        new.extend(items)
         offset += limit
+        if not page['items'] or offset >= page['total']:
+            break
+    index.add_newest(user_id, new)
+    index.save()
+
+def find_playlist_id(sp, user_id, playlist_name, cache):
+    """Find a writable playlist by name using the playlist cache and the local index.
+
+    The index is rebuilt from Spotify when it is stale. If the name isn't in
+    it and it wasn't checked in the last PLAYLIST_INDEX_RECHECK_AGE seconds,
+    only the playlists created since are fetched.
+    """
+    index = get_playlist_index()
+    playlist_id = cache.get(playlist_cache_key(user_id, playlist_name))
+    if playlist_id is not None:
+        entry = index.get(user_id, playlist_id)
+        # Ignore the cached ID if the index shows the playlist has been renamed
+        if entry is None or normalize_playlist_name(entry['name']) == normalize_playlist_name(playlist_name):
+            return playlist_id
+    
+    if not index.is_fresh(user_id):
+        build_playlist_index(sp, user_id)
+    playlist_id = index.find(user_id, playlist_name)
+    if playlist_id is None and not index.checked_recently(user_id, PLAYLIST_INDEX_RECHECK_AGE):
+        # It may have been created since the index was last checked
+        refresh_playlist_index(sp, user_id)
+        playlist_id = index.find(user_id, playlist_name)
+    return playlist_id
+
+def get_or_create_playlist(sp, playlist_name, auto_update=False):
+    """Get existing playlist or create a new one.
+
+    A playlist this tool has written to before is returned without any call;
+    its description is refreshed by update_playlist with the next change of
+    tracks. Any other match gets its description written first, which also
+    proves the playlist can be modified.
+    """
+    user_id = get_current_user_id(sp)
+    index = get_playlist_index()
+    description = playlist_description(auto_update)
+    
+    cache = get_playlist_store()
+    key = playlist_cache_key(user_id, playlist_name)
+    playlist_id = find_playlist_id(sp, user_id, playlist_name, cache)
+    while playlist_id is not None:
+        try:
+            if not is_known_playlist(user_id, playlist_id):
+                sp.playlist_change_details(playlist_id, description=description)
+                _record_playlist_state(playlist_id, user_id=user_id, description=description)
+            print(f"\nFound existing playlist: {playlist_name}")
+            if cache.get(key) != playlist_id:
+                cache.set(key, playlist_id)
+                cache.flush()
+            return playlist_id
+        except Exception as e:
+            # If there's any error, drop it from the cache and index and try the next match
+            print(f"Cannot modify playlist: {str(e)}")
+            if key in cache:
+                cache.delete(key)
+                cache.flush()
+            index.remove(user_id, playlist_id)
+            index.save()
+            playlist_id = index.find(user_id, playlist_name)
     
     # Create new playlist if not found or no writable playlist found
     print(f"\nCreating new playlist: {playlist_name}")
-    desc = "Auto-updated playlist of top songs" if auto_update else "Your top songs playlist"
     playlist = sp.user_playlist_create(
         user_id,
         playlist_name,
         public=False,
-        description=f"{desc}. Last updated: {datetime.now().strftime('%Y-%m-%d')}"
+        description=description
     )
     
-    # Save to cache
-    cache[playlist_name] = playlist['id']
-    save_playlist_cache(cache)
+    # Save to cache and index
+    cache.set(key, playlist['id'])
+    cache.flush()
+    _record_playlist_state(playlist['id'], user_id=user_id, description=description)
+    index.add(user_id, playlist)
+    index.save()
     
     # Wait a moment for the playlist to be available
     sleep(2)
     
     return playlist['id']
 
-def update_playlist(sp, playlist_id, track_uris):
-    """Replace all tracks in the playlist with new ones."""
-    sp.playlist_replace_items(playlist_id, track_uris)
+def _record_playlist_state(playlist_id, **fields):
+    """Merge fields into the stored state record of a playlist."""
+    state = get_playlist_state_store()
+    state.set(playlist_id, dict(state.get(playlist_id) or {}, **fields))
+    state.flush()
+
+def load_playlist_state():
+    """Load the last known snapshot_id and track URIs of each playlist."""
+    return get_playlist_state_store().to_dict()
+
+def save_playlist_state(state):
+    """Save playlist snapshot state to file."""
+    _save_store(get_playlist_state_store(), state)
+
+def get_playlist_contents(sp, playlist_id):
+    """Return (snapshot_id, track_uris) for a playlist.
+
+    Items whose track is no longer available are None in track_uris, so the
+    positions of the other tracks match the playlist. If the locally stored snapshot_id still matches, the stored URI list is
+    used and only the snapshot_id is requested. Otherwise the playlist changed
+    outside this tool, so its name and snapshot are refreshed in the index too.
+    """
+    stored = get_playlist_state_store().get(playlist_id)
+    if stored is not None and 'snapshot_id' in stored:
+        snapshot_id = sp.playlist(playlist_id, fields='snapshot_id')['snapshot_id']
+        if snapshot_id == stored['snapshot_id']:
+            return snapshot_id, stored['uris']
+    
+    result = sp.playlist(playlist_id, fields='name,snapshot_id,tracks(total,items(track(uri)))')
+    snapshot_id = result['snapshot_id']
+    get_playlist_index().update(get_current_user_id(sp), playlist_id,
+                                name=result['name'], snapshot_id=snapshot_id)
+    items = result['tracks']['items']
+    total = result['tracks']['total']
+    pages = run_concurrently(
+        lambda offset: sp.playlist_items(playlist_id, fields='items(track(uri))', limit=100, offset=offset),
+        [(offset,) for offset in range(len(items), total, 100)]
+    )
+    for page in pages:
+        items.extend(page['items'])
+    
+    uris = [item['track']['uri'] if item.get('track') else None for item in items]
+    return snapshot_id, uris
+
+def update_playlist(sp, playlist_id, track_uris, fingerprint=None, description=None):
+    """Update the playlist so it contains exactly track_uris, in order.
+
+    Only the add/remove/reorder operations needed to get from the current
+    contents to the new list are sent, and nothing is written if the playlist
+    is already up to date. When tracks change, description (see
+    playlist_description) is written too unless it is the last one written,
+    so the date is refreshed at most once a day. The fingerprint the tracks
+    were chosen from (see playlist_fingerprint) is stored for later checks.
+    Returns the number of track write operations sent.
+    """
+    snapshot_id, current_uris = get_playlist_contents(sp, playlist_id)
+    ops = diff_playlist(current_uris, track_uris)
+    stored = get_playlist_state_store().get(playlist_id) or {}
+    last_description = stored.get('description')
+    if ops and description and description != last_description:
+        # Written before the tracks, so the snapshot of the last track write is the latest
+        sp.playlist_change_details(playlist_id, description=description)
+        last_description = description
+    if ops:
+        snapshot_id = apply_playlist_ops(sp, playlist_id, ops) or snapshot_id
+    
+    state = get_playlist_state_store()
+    state.set(playlist_id, {
+        'user_id': get_current_user_id(sp),
+        'snapshot_id': snapshot_id,
+        'uris': list(track_uris),
+        'fingerprint': fingerprint,
+        'description': last_description,
+        'updated_at': time.time()
+    })
+    state.flush()
+    
+    index = get_playlist_index()
+    index.update(get_current_user_id(sp), playlist_id, snapshot_id=snapshot_id)
+    index.save()
+    return len(ops)
+
+def plan_playlist_update(sp, playlist_name, track_uris, description=None):
+    """Work out what get_or_create_playlist and update_playlist would do, using only read calls.
+
+    Returns a plan dict:
+    - 'name': the playlist name asked for
+    - 'action': 'create', 'update' or 'unchanged'
+    - 'playlist_id': the existing playlist, or None if one would be created
+    - 'current_name': the existing playlist's name if it differs from name
+      (names are matched ignoring case and extra whitespace), else None
+    - 'ops': the write operations update_playlist would send (see diff_playlist)
+    - 'writes': the number of write calls, including creating the playlist
+      or writing description to it
+    """
+    user_id = get_current_user_id(sp)
+    track_uris = list(track_uris)
+    playlist_id = find_playlist_id(sp, user_id, playlist_name, get_playlist_store())
+    if playlist_id is None:
+        ops = diff_playlist([], track_uris)
+        return {'name': playlist_name, 'action': 'create', 'playlist_id': None, 'current_name': None,
+                'ops': ops, 'writes': 1 + len(ops)}
+    
+    _, current_uris = get_playlist_contents(sp, playlist_id)
+    ops = diff_playlist(current_uris, track_uris)
+    if not is_known_playlist(user_id, playlist_id):
+        writes = 1 + len(ops)
+    else:
+        last_description = get_playlist_state_store().get(playlist_id).get('description')
+        writes = len(ops) + (1 if ops and description and description != last_description else 0)
+    entry = get_playlist_index().get(user_id, playlist_id)
+    current_name = entry['name'] if entry is not None and entry['name'] != playlist_name else None
+    return {'name': playlist_name, 'action': 'update' if ops else 'unchanged', 'playlist_id': playlist_id,
+            'current_name': current_name, 'ops': ops, 'writes': writes}
+
+def describe_plan(plan):
+    """Return the lines describing a plan from plan_playlist_update."""
+    if plan['action'] == 'create':
+        lines = [f"'{plan['name']}': create a new playlist"]
+    elif plan['action'] == 'update':
+        lines = [f"'{plan['name']}': update playlist {plan['playlist_id']}"]
+    else:
+        lines = [f"'{plan['name']}': already up to date (playlist {plan['playlist_id']})"]
+    if plan['current_name']:
+        lines.append(f"  Matches the existing playlist '{plan['current_name']}'")
+    lines.append(f"  Changes: {summarize_ops(plan['ops'])}")
+    lines.append(f"  Write calls: {plan['writes']}")
+    return lines
+
+def print_plan(plan):
+    """Print a plan from plan_playlist_update."""
+    print()
+    for line in describe_plan(plan):
+        print(line)
 
 def print_track_list(tracks, header="Tracks:"):
     """Print a formatted list of tracks."""
     print(f"\n{header}")
     for i, track in enumerate(tracks, 1):
-        artists = ", ".join([artist['name'] for artist in track['artists']])
-        print(f"{i}. {track['name']} - {artists}")
+        print(f"{i}. {track.name} - {track.artist_names}")
+
+def get_genre_cache():
+    """Return the process-wide artist genre cache, loading it on first use."""
+    global _genre_cache
+    if _genre_cache is None:
+        _genre_cache = GenreCache(GENRE_CACHE_FILE)
+    return _genre_cache
+
+def resolve_artist_genres(sp, artist_ids):
+    """Get genres for many artists at once.
+
+    Artist IDs are deduplicated, served from the genre cache where possible,
+    and the rest are fetched in batches of 50. Returns {artist_id: set(genres)}.
+    """
+    cache = get_genre_cache()
+    genres_by_artist = {}
+    missing = []
+    for artist_id in dict.fromkeys(artist_ids):
+        genres = cache.get(artist_id)
+        if genres is None:
+            missing.append(artist_id)
+        else:
+            genres_by_artist[artist_id] = genres
+    
+    batches = [missing[i:i + ARTIST_BATCH_SIZE] for i in range(0, len(missing), ARTIST_BATCH_SIZE)]
+    responses = run_concurrently(sp.artists, [(batch,) for batch in batches], return_exceptions=True)
+    for batch, results in zip(batches, responses):
+        if isinstance(results, Exception):
+            print(f"Warning: Error fetching genres for {len(batch)} artists: {str(results)}")
+            continue
+        for artist in results['artists']:
+            if artist is None:
+                continue
+            genres = set(artist['genres'])
+            cache.set(artist['id'], genres)
+            genres_by_artist[artist['id']] = genres
+    
+    cache.save()
+    return genres_by_artist
+
+def resolve_track_genres(sp, tracks):
+    """Get genres for a list of tracks with a single batched artist lookup.
+    Returns a list of genre sets, one per track.
+    """
+    artist_ids = [artist.id for track in tracks for artist in track.artists if artist.id]
+    genres_by_artist = resolve_artist_genres(sp, artist_ids)
+    track_genres = []
+    for track in tracks:
+        genres = set()
+        for artist in track.artists:
+            genres.update(genres_by_artist.get(artist.id, set()))
+        track_genres.append(genres)
+    return track_genres
 
 def get_artist_genres(sp, artist_id):
     """Get genres for a specific artist."""
-    try:
-        artist = sp.artist(artist_id)
-        return set(artist['genres'])
-    except:
-        return set()
+    return resolve_artist_genres(sp, [artist_id]).get(artist_id, set())
 
 def get_track_genres(sp, track):
     """Get all genres associated with a track's artists."""
-    genres = set()
-    for artist in track['artists']:
-        artist_genres = get_artist_genres(sp, artist['id'])
-        genres.update(artist_genres)
-    return genres
-
-def filter_tracks_by_genre(sp, tracks, genre=None):
-    """Filter tracks by genre. If genre is None, return all tracks."""
+    return resolve_track_genres(sp, [track])[0]
+
+def load_genre_variations():
+    """Load the genre variation table, with any overrides from config/genres.json.
+
+    The file maps a genre to the list of Spotify genres that count as it, e.g.
+    {"rock": ["rock", "modern rock", "garage rock"]}.
+    """
+    variations = dict(DEFAULT_GENRE_VARIATIONS)
+    if os.path.exists(GENRE_VARIATIONS_FILE):
+        with open(GENRE_VARIATIONS_FILE, 'r') as f:
+            for genre, related in json.load(f).items():
+                variations[genre.lower()] = {g.lower() for g in related}
+    return variations
+
+def get_genre_matcher(genre):
+    """Return the compiled matcher for a genre, building it on first use."""
+    global _genre_variations
+    genre = genre.lower()
+    if genre not in _genre_matchers:
+        if _genre_variations is None:
+            _genre_variations = load_genre_variations()
+        _genre_matchers[genre] = GenreMatcher(genre, _genre_variations)
+    return _genre_matchers[genre]
+
+def filter_tracks_by_genre(sp, tracks, genre=None, track_genres=None):
+    """Filter tracks by genre. If genre is None, return all tracks.
+    track_genres can be passed in (as returned by resolve_track_genres) to
+    reuse one genre resolution across several filters.
+    """
     if not genre:
         return tracks
+    if track_genres is None:
+        track_genres = resolve_track_genres(sp, tracks)
     
-    filtered_tracks = []
-    genre = genre.lower()
-    
-    # Define genre variations and related genres
-    genre_variations = {
-        'pop': {'pop', 'dance pop', 'pop dance', 'electropop'},  # but not k-pop
-        'rock': {'rock', 'modern rock', 'alternative rock', 'indie rock'},
-        'rap': {'rap', 'melodic rap', 'hip hop', 'trap', 'drill', 'brooklyn drill', 'new york drill'},
-        'hip hop': {'hip hop', 'rap', 'melodic rap', 'trap'},
-        'electronic': {'electronic', 'edm', 'electro', 'dance'},
-    }
-    
-    print(f"\nDebug: Looking for genre '{genre}'")
-    for track in tracks:
-        track_genres = get_track_genres(sp, track)
-        artists = ", ".join(artist['name'] for artist in track['artists'])
-        print(f"\nTrack: {track['name']} - {artists}")
-        print(f"Genres: {sorted(track_genres)}")
-        
-        # Check if any of the track's genres match our criteria
-        matched = False
-        for g in track_genres:
-            g_lower = g.lower()
-            
-            # Exact match
-            if g_lower == genre:
-                matched = True
-                break
-                
-            # Check variations for single-word genres
-            if genre in genre_variations and g_lower in genre_variations[genre]:
-                matched = True
-                break
-                
-            # For compound genres (e.g., "pop rock"), allow partial matches
-            # but ensure it's not matching substrings of other genres (e.g., "pop" shouldn't match "k-pop")
-            if (genre.count(' ') > 0 and 
-                genre in g_lower and 
-                not any(x in g_lower for x in ['k-pop', 'j-pop'])):  # exclude specific genres
-                matched = True
-                break
-        
-        if matched:
-            filtered_tracks.append(track)
-            print("✓ Match found!")
-    
-    return filtered_tracks
+    matcher = get_genre_matcher(genre)
+    if logger.isEnabledFor(logging.DEBUG):
+        # Match one track at a time so each one is logged
+        return [track for track, matched in _match_genres(matcher, zip(tracks, track_genres)) if matched]
+    return matcher.filter(tracks, track_genres)
 
 def get_available_genres(sp, tracks):
     """Get a list of all available genres from the tracks."""
     all_genres = set()
-    for track in tracks:
-        track_genres = get_track_genres(sp, track)
+    for track_genres in resolve_track_genres(sp, tracks):
         all_genres.update(track_genres)
     return sorted(all_genres)
 
-# Create necessary directories
-os.makedirs(CONFIG_DIR, exist_ok=True)
-os.makedirs(CACHE_DIR, exist_ok=True)
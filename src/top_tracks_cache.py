@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import threading
+from urllib.parse import quote
+from cache_store import atomic_write_json
+from track_model import parse_tracks, dump_tracks, load_tracks
+
+class TopTracksCache:
+    """On-disk cache of top-tracks pages.
+
+    A page is {'items': [Track], 'total'}; on disk its tracks are stored in the
+    compact form of dump_tracks. Pages are keyed by (user, time_range, offset, limit) and stored with their
+    fetch time and ETag. A page younger than max_age is served without any
+    network call; an older page with an ETag can be revalidated with
+    If-None-Match so an unchanged ranking costs a single 304 response.
+
+    Every user's pages are kept in their own file in directory, loaded on the
+    user's first lookup, so saving only rewrites the files of users whose
+    pages changed.
+    """
+
+    def __init__(self, directory, max_age=6 * 3600):
+        self.directory = directory
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._users = {}
+        self._dirty = set()
+        self._lock = threading.RLock()
+        # Held while writing files, so saves don't hold up lookups but still land in order
+        self._save_lock = threading.Lock()
+
+    @staticmethod
+    def _decode_page(page):
+        if 'tracks' in page:
+            items = load_tracks(page['tracks'])
+        else:
+            # Caches written before pages were compacted hold track objects
+            items = parse_tracks(page.get('items') or [])
+        return {'items': items, 'total': page.get('total')}
+
+    @staticmethod
+    def _encode_page(page):
+        return {'tracks': dump_tracks(page['items']), 'total': page.get('total')}
+
+    @staticmethod
+    def _key(time_range, offset, limit):
+        return f"{time_range}|{offset}|{limit}"
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, quote(str(user_id), safe='') + '.json')
+
+    def _entries(self, user_id):
+        """Return the pages of user_id by key, loading their file on first use."""
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries is not None:
+                return entries
+            entries = {}
+            path = self._path(user_id)
+            if os.path.exists(path):
+                try:
+                    with open(path, 'r') as f:
+                        entries = json.load(f)
+                    for entry in entries.values():
+                        entry['page'] = self._decode_page(entry['page'])
+                except (OSError, ValueError, KeyError, TypeError):
+                    entries = {}
+            self._users[user_id] = entries
+            return entries
+
+    def lookup(self, user_id, time_range, offset, limit):
+        """Return (page, etag, fresh) for a cached page, or (None, None, False) if not cached."""
+        entry = self._entries(user_id).get(self._key(time_range, offset, limit))
+        if entry is None:
+            return None, None, False
+        fresh = time.time() - entry['fetched_at'] <= self.max_age
+        return entry['page'], entry.get('etag'), fresh
+
+    def store(self, user_id, time_range, offset, limit, page, etag=None):
+        """Store a freshly fetched page."""
+        with self._lock:
+            self._entries(user_id)[self._key(time_range, offset, limit)] = {
+                'page': page,
+                'etag': etag,
+                'fetched_at': time.time()
+            }
+            self._dirty.add(user_id)
+
+    def touch(self, user_id, time_range, offset, limit):
+        """Mark a cached page as fresh again after a successful revalidation."""
+        with self._lock:
+            entry = self._entries(user_id).get(self._key(time_range, offset, limit))
+            if entry is not None:
+                entry['fetched_at'] = time.time()
+                self._dirty.add(user_id)
+
+    def record(self, counter):
+        """Increment one of the 'hits', 'misses' or 'revalidations' counters.
+        Pages are fetched from several threads, so this takes a lock.
+        """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        """Return the hit/miss/revalidation counters."""
+        return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations}
+
+    def save(self):
+        """Write the files of the users whose pages changed."""
+        with self._save_lock:
+            with self._lock:
+                snapshots = {user_id: {key: dict(entry, page=self._encode_page(entry['page']))
+                                       for key, entry in self._users[user_id].items()}
+                             for user_id in self._dirty}
+                self._dirty.clear()
+            for user_id, data in snapshots.items():
+                try:
+                    atomic_write_json(self._path(user_id), data)
+                except BaseException:
+                    with self._lock:
+                        self._dirty.add(user_id)
+                    raise
@@ -0,0 +1,93 @@
+import weakref
+
+class Artist:
+    """An artist as tracks reference it: just its ID (None for local files) and name.
+
+    Artists are interned by get_artist, so every track by the same artist
+    shares one object for as long as any of them is alive.
+    """
+    __slots__ = ('id', 'name', '__weakref__')
+
+    def __init__(self, artist_id, name):
+        self.id = artist_id
+        self.name = name
+
+    def __eq__(self, other):
+        if not isinstance(other, Artist):
+            return NotImplemented
+        return self.id == other.id and self.name == other.name
+
+    def __hash__(self):
+        return hash((self.id, self.name))
+
+    def __repr__(self):
+        return f"Artist({self.id!r}, {self.name!r})"
+
+class Track:
+    """A track reduced to what playlists use: its URI, name and artists (a tuple of Artist)."""
+    __slots__ = ('uri', 'name', 'artists')
+
+    def __init__(self, uri, name, artists):
+        self.uri = uri
+        self.name = name
+        self.artists = artists
+
+    @property
+    def artist_names(self):
+        return ", ".join(artist.name for artist in self.artists)
+
+    def __eq__(self, other):
+        if not isinstance(other, Track):
+            return NotImplemented
+        return self.uri == other.uri and self.name == other.name and self.artists == other.artists
+
+    def __hash__(self):
+        return hash(self.uri)
+
+    def __repr__(self):
+        return f"Track({self.uri!r}, {self.name!r}, {self.artists!r})"
+
+_artists = weakref.WeakValueDictionary()
+
+def get_artist(artist_id, name):
+    """Return the shared Artist object for an ID and name, creating it on first use."""
+    key = (artist_id, name)
+    artist = _artists.get(key)
+    if artist is None:
+        # setdefault keeps the first object if another thread interned the artist meanwhile
+        artist = _artists.setdefault(key, Artist(artist_id, name))
+    return artist
+
+def parse_track(data):
+    """Build a Track from a Spotify track object (or any dict with uri, name and artists)."""
+    return Track(data['uri'], data['name'],
+                 tuple([get_artist(artist.get('id'), artist['name']) for artist in data['artists']]))
+
+def parse_tracks(items):
+    """Build Tracks from a list of Spotify track objects, skipping missing (None) tracks."""
+    return [parse_track(item) for item in items if item]
+
+def dump_tracks(tracks):
+    """Serialize tracks compactly for JSON: each artist is written once and
+    tracks refer to artists by position.
+
+    Returns {'artists': [[id, name], ...], 'tracks': [[uri, name, [artist positions]], ...]}.
+    """
+    positions = {}
+    artists = []
+    rows = []
+    for track in tracks:
+        refs = []
+        for artist in track.artists:
+            position = positions.get(artist)
+            if position is None:
+                position = positions[artist] = len(artists)
+                artists.append([artist.id, artist.name])
+            refs.append(position)
+        rows.append([track.uri, track.name, refs])
+    return {'artists': artists, 'tracks': rows}
+
+def load_tracks(data):
+    """Rebuild the tracks serialized by dump_tracks."""
+    artists = [get_artist(artist_id, name) for artist_id, name in data['artists']]
+    return [Track(uri, name, tuple([artists[i] for i in refs])) for uri, name, refs in data['tracks']]
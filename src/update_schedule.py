@@ -0,0 +1,73 @@
+import time
+import random
+
+class UpdateScheduler:
+    """Decides when the daemon runs its next cycle.
+
+    Deadlines are kept on the monotonic clock and each one is computed from
+    the previous deadline rather than from when the cycle ended, so the time a
+    cycle takes doesn't push the schedule back. Every run is shifted by a
+    random jitter of up to jitter * interval, without moving the deadlines
+    themselves.
+
+    After a failed cycle the delay grows exponentially from the interval up to
+    max_backoff. When min_interval and max_interval differ the interval also
+    adapts to how much is changing: it is multiplied by idle_factor after a
+    cycle that wrote nothing and divided by change_factor after one that
+    changed a playlist, staying between the two bounds.
+    """
+
+    def __init__(self, interval, min_interval=None, max_interval=None, jitter=0.1, max_backoff=None,
+                 idle_factor=1.5, change_factor=2.0):
+        self.base_interval = interval
+        self.min_interval = min(interval, min_interval or interval)
+        self.max_interval = max(interval, max_interval or interval)
+        self.jitter = jitter
+        self.max_backoff = max_backoff or max(self.max_interval, interval * 8)
+        self.idle_factor = idle_factor
+        self.change_factor = change_factor
+        self.interval = interval
+        self.failures = 0
+        self._deadline = time.monotonic()
+        self._run_at = self._deadline
+
+    @property
+    def adaptive(self):
+        return self.min_interval != self.max_interval
+
+    def seconds_until_next_run(self):
+        return max(0.0, self._run_at - time.monotonic())
+
+    def wait(self):
+        """Sleep until the next run is due."""
+        while True:
+            remaining = self._run_at - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def record(self, success, changed=True):
+        """Schedule the next run after a cycle and return the delay until it, in seconds.
+
+        changed tells whether the cycle wrote to any playlist.
+        """
+        if success:
+            self.failures = 0
+            if self.adaptive:
+                if changed:
+                    self.interval = max(self.min_interval, self.interval / self.change_factor)
+                else:
+                    self.interval = min(self.max_interval, self.interval * self.idle_factor)
+            delay = self.interval
+        else:
+            self.failures += 1
+            delay = min(self.max_backoff, self.interval * 2 ** (self.failures - 1))
+
+        now = time.monotonic()
+        self._deadline += delay
+        if self._deadline < now:
+            # The cycle overran the next deadline: run again now instead of catching up every missed run
+            self._deadline = now
+        offset = random.uniform(-self.jitter, self.jitter) * delay if self.jitter else 0.0
+        self._run_at = max(now, self._deadline + offset)
+        return self._run_at - now